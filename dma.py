@@ -1,3 +1,9 @@
+from array   import array                     # type: ignore
+from time    import ticks_us, ticks_diff      # type: ignore
+from uctypes import addressof                 # type: ignore
+
+import resources
+
 # Constants for the various Transfer REQuest sources
 TREQ_PIO0_TX    = 0
 TREQ_PIO1_TX    = 1
@@ -46,16 +52,143 @@ TREQ_XIP_STREAM = 37
 TREQ_XIP_SSITX  = 38
 TREQ_XIP_SSIRX  = 39
 
+TREQ_TIMER0     = 0x3b
+TREQ_TIMER1     = 0x3c
+TREQ_TIMER2     = 0x3d
+TREQ_TIMER3     = 0x3e
+TREQ_UNPACED    = 0x3f
+
+# Register addresses - see section 2.5.7 of the RP2040 datasheet
+DMA_BASE            = 0x50000000
+DMA_CHANNELS        = 12
+DMA_INTR            = DMA_BASE + 0x400   # Raw interrupt status, one bit per channel
+DMA_INTE0           = DMA_BASE + 0x404   # Interrupt enables for DMA_IRQ_0
+DMA_INTS0           = DMA_BASE + 0x40C   # Interrupt status for DMA_IRQ_0 - write 1 to clear
+DMA_TIMER0          = DMA_BASE + 0x420
+DMA_MULTI_TRIGGER   = DMA_BASE + 0x430   # Write a bitmap of channels to start them all at once
+DMA_SNIFF_CTRL      = DMA_BASE + 0x434
+DMA_SNIFF_DATA      = DMA_BASE + 0x438
+DMA_CHAN_ABORT      = DMA_BASE + 0x444
+
+ATOMIC_SET          = 0x2000             # Offsets to the atomic set/clear aliases of any peripheral register
+ATOMIC_CLEAR        = 0x3000
+
+# Per-channel register offsets from the channel base (DMA_BASE + channel * 0x40). The four aliases present the same four
+# registers in different orders, and a write to the last register of each alias starts the transfer.
+READ_ADDR           = 0x00               # Alias 0: READ_ADDR, WRITE_ADDR, TRANS_COUNT, CTRL_TRIG
+WRITE_ADDR          = 0x04
+TRANS_COUNT         = 0x08
+CTRL_TRIG           = 0x0C
+AL1_CTRL            = 0x10               # Alias 1: CTRL, READ_ADDR, WRITE_ADDR, TRANS_COUNT_TRIG
+AL1_TRANS_COUNT_TRIG= 0x1C
+AL2_WRITE_ADDR_TRIG = 0x2C               # Alias 2: CTRL, TRANS_COUNT, READ_ADDR, WRITE_ADDR_TRIG
+AL3_READ_ADDR_TRIG  = 0x3C               # Alias 3: CTRL, WRITE_ADDR, TRANS_COUNT, READ_ADDR_TRIG
+
+# Control register fields
+CTRL_EN             = 1 << 0
+CTRL_HIGH_PRIORITY  = 1 << 1
+CTRL_DATA_SIZE      = 2                  # Shift: 0 => byte, 1 => halfword, 2 => word
+CTRL_INCR_READ      = 1 << 4
+CTRL_INCR_WRITE     = 1 << 5
+CTRL_RING_SIZE      = 6                  # Shift: wrap at 2^n bytes, 0 => no ring
+CTRL_RING_SEL       = 1 << 10            # 0 => read address wraps, 1 => write address wraps
+CTRL_CHAIN_TO       = 11                 # Shift
+CTRL_TREQ_SEL       = 15                 # Shift
+CTRL_IRQ_QUIET      = 1 << 21
+CTRL_BSWAP          = 1 << 22
+CTRL_SNIFF_EN       = 1 << 23
+CTRL_BUSY           = 1 << 24
+
+SIZE_BYTE           = 0
+SIZE_HALFWORD       = 1
+SIZE_WORD           = 2
+
+# Unpaced word transfers used by Fill() and Copy() - the chain-to field is filled in per channel
+_FILL_CONTROL       = CTRL_EN | CTRL_HIGH_PRIORITY | (SIZE_WORD << CTRL_DATA_SIZE) | CTRL_INCR_WRITE | (TREQ_UNPACED << CTRL_TREQ_SEL) | CTRL_IRQ_QUIET
+_COPY_CONTROL       = _FILL_CONTROL | CTRL_INCR_READ
+
+# Unpaced reads into a single word, sniffed - used by Checksum(). The data size and chain-to are filled in per call.
+_SNIFF_CONTROL      = CTRL_EN | CTRL_HIGH_PRIORITY | CTRL_INCR_READ | (TREQ_UNPACED << CTRL_TREQ_SEL) | CTRL_IRQ_QUIET | CTRL_SNIFF_EN
+
+# Sniffer calculations (SNIFF_CTRL.CALC)
+SNIFF_CALC_CRC32    = 0x0                # CRC-32 (IEEE 802.3 polynomial)
+SNIFF_CALC_CRC32R   = 0x1                # CRC-32 with bit reversed data
+SNIFF_CALC_CRC16    = 0x2                # CRC-16-CCITT
+SNIFF_CALC_CRC16R   = 0x3                # CRC-16-CCITT with bit reversed data
+SNIFF_CALC_XOR      = 0xE                # XOR reduction
+SNIFF_CALC_SUM      = 0xF                # 32 bit sum
+
+# Sniffer modes: (calculation, seed, bit reverse result, invert result) giving the usual form of each checksum
+SNIFF_CRC32         = (SNIFF_CALC_CRC32R, 0xFFFFFFFF, True,  True)   # As zlib.crc32() / binascii.crc32()
+SNIFF_CRC16         = (SNIFF_CALC_CRC16,  0xFFFF,     False, False)  # CRC-16/CCITT-FALSE
+SNIFF_SUM           = (SNIFF_CALC_SUM,    0,          False, False)
+SNIFF_XOR           = (SNIFF_CALC_XOR,    0,          False, False)
+
+@micropython.viper                                      # type: ignore
+def arm(transfer: ptr32):                               # type: ignore
+    """ Start a transfer compiled by DmaChannel.Compile() - a single call writing five registers """
+    regs    = ptr32(transfer[4])                        # type: ignore
+    regs[4] = 0                                         # AL1_CTRL: pause the channel while it is reloaded
+    regs[0] = transfer[0]                               # READ_ADDR
+    regs[1] = transfer[1]                               # WRITE_ADDR
+    regs[2] = transfer[2]                               # TRANS_COUNT
+    regs[3] = transfer[3]                               # CTRL_TRIG: starts the transfer
+
+@micropython.viper                                      # type: ignore
+def load(transfer: ptr32):                              # type: ignore
+    """ Load a transfer compiled by DmaChannel.Compile() without starting it - see trigger() """
+    regs    = ptr32(transfer[4])                        # type: ignore
+    regs[4] = 0                                         # AL1_CTRL: pause the channel while it is reloaded
+    regs[0] = transfer[0]                               # READ_ADDR
+    regs[1] = transfer[1]                               # WRITE_ADDR
+    regs[2] = transfer[2]                               # TRANS_COUNT
+    regs[4] = transfer[3]                               # AL1_CTRL: enabled, but waiting for a trigger
+
+@micropython.viper                                      # type: ignore
+def trigger(channels: uint):                            # type: ignore
+    """ Start all of the loaded channels in the bitmap at the same moment """
+    ptr32(DMA_MULTI_TRIGGER)[0] = channels              # type: ignore
+
+
+def sniffer_attach(channel, mode=SNIFF_CRC32, seed=None):
+    """ Point the sniffer at a channel - every transfer the channel makes with SNIFF_EN set (see SetSniff()) is fed
+    through the calculation. Claim the sniffer from resources.py first, as there is only one.
+
+    Args:
+        channel (DmaChannel):   The channel to watch
+        mode (tuple, optional): One of the SNIFF_... modes. Defaults to SNIFF_CRC32.
+        seed (int, optional):   Starting value, to continue a calculation. Defaults to the mode's usual seed.
+    """
+    calc, modeSeed, reverse, invert = mode
+    _write(DMA_SNIFF_DATA, modeSeed if seed is None else seed)
+    _write(DMA_SNIFF_CTRL, 1 | (channel.ChannelNumber << 1) | (calc << 5) | ((1 if reverse else 0) << 10) | ((1 if invert else 0) << 11))
+
+@micropython.viper                                      # type: ignore
+def sniffer_result() -> uint:                           # type: ignore
+    """ The checksum so far - CRC16 results are in the low 16 bits """
+    return uint(ptr32(DMA_SNIFF_DATA)[0])               # type: ignore
+
+def sniffer_detach():
+    _write(DMA_SNIFF_CTRL, 0)
+
 class DmaChannel:
+    """ A single DMA channel, configured through its memory mapped registers
+
+    The control word is built up in ControlValue by the Set.../No... methods and only written to the hardware when a
+    transfer is started. Transfers which are repeated can be compiled once with Compile() and restarted with a single
+    call to arm(), which writes the five registers without any further Python work.
+    """
     def __init__(self, channelNumber):
         offset = channelNumber * 0x40
 
         self.ChannelNumber          = channelNumber
-        self.ReadRegister           = 0x50000000 + offset
-        self.WriteRegister          = 0x50000004 + offset
-        self.TransferCountRegister  = 0x50000008 + offset
-        self.TriggerControlRegister = 0x5000000C + offset
-        self.ControlRegister        = 0x50000010 + offset
+        self.ChannelMask            = 1 << channelNumber
+        self.ChannelBase            = DMA_BASE + offset
+        self.ReadRegister           = DMA_BASE + READ_ADDR   + offset
+        self.WriteRegister          = DMA_BASE + WRITE_ADDR  + offset
+        self.TransferCountRegister  = DMA_BASE + TRANS_COUNT + offset
+        self.TriggerControlRegister = DMA_BASE + CTRL_TRIG   + offset
+        self.ControlRegister        = DMA_BASE + AL1_CTRL    + offset
 
         self.ControlValue = 0x003F8033 + (channelNumber << 11) # Enable, Hi-priority, Bytes, no chain-to, increment both read and write, no IRQs, no ring
         # Bit 31302928 27262524 23222120 19181716 15141312 11100908 07060504 03020100          
@@ -83,23 +216,27 @@ class DmaChannel:
         #      | +--------------------------------------------------------------------    30: (0)    READ_ERROR       - Not cleared
         #      +----------------------------------------------------------------------    31: (0)    AHB_ERROR        - Read only
 
+        # Scratch transfer used by Fill(), Copy() and Checksum()
+        self._transfer = self.Compile(0, 0, 0)
+        self._fillWord = array("I", [0])
+
+        # Optional instrumentation - see EnableTiming()
+        self.Timing    = None
+
     @micropython.viper                             # type: ignore
     def SetWriteAddress(self, address: uint):      # type: ignore
         ptr = ptr32(self.WriteRegister)            # type: ignore
         ptr[0] = address
-        #self.WriteAddress = address
         
     @micropython.viper                             # type: ignore
     def SetReadAddress(self, address: uint):       # type: ignore
         ptr = ptr32(self.ReadRegister)             # type: ignore
         ptr[0] = address
-        #self.ReadAddress = address
         
     @micropython.viper                             # type: ignore
     def SetTransferCount(self, count: uint):       # type: ignore
         ptr = ptr32(self.TransferCountRegister)    # type: ignore
         ptr[0] = count
-        #self.TransferCount = count
         
     @micropython.viper                             # type: ignore
     def SetControlRegister(self, controlValue: uint):      # type: ignore
@@ -117,10 +254,45 @@ class DmaChannel:
     def TriggerChannel(self):
         ptr= ptr32(self.TriggerControlRegister)    # type: ignore
         ptr[0] = uint(self.ControlValue)           # type: ignore
-        
+
+    @micropython.viper                             # type: ignore
+    def TransferCount(self) -> uint:               # type: ignore
+        # While a transfer is running this is the number of transfers still to do
+        ptr = ptr32(self.TransferCountRegister)    # type: ignore
+        return uint(ptr[0])                        # type: ignore
+
+    @micropython.viper                             # type: ignore
+    def ReadAddress(self) -> uint:                 # type: ignore
+        ptr = ptr32(self.ReadRegister)             # type: ignore
+        return uint(ptr[0])                        # type: ignore
+
+    @micropython.viper                             # type: ignore
+    def IsBusy(self) -> bool:                      # type: ignore
+        ptr = ptr32(self.ControlRegister)          # type: ignore
+        return (ptr[0] & 0x01000000) != 0
+
+    def WaitForCompletion(self):
+        while self.IsBusy():
+            pass
+        if self.Timing is not None:
+            self.Timing.Poll()
+
+    @micropython.viper                             # type: ignore
+    def Abort(self):
+        # Stop the channel part way through a transfer, waiting for any in-flight transfers to complete
+        mask  = uint(self.ChannelMask)             # type: ignore
+        abort = ptr32(DMA_CHAN_ABORT)              # type: ignore
+        abort[0] = mask
+        while uint(abort[0]) & mask:               # type: ignore
+            pass
+
     def SetChainTo(self, chainNumber : uint):      # type: ignore
         self.ControlValue  &= ~ 0x7800
         self.ControlValue |= (chainNumber <<11)
+
+    def NoChain(self):
+        # A channel chained to itself does not chain
+        self.SetChainTo(self.ChannelNumber)
         
     def SetByteTransfer(self):
         self.ControlValue  &= ~ 0xC
@@ -130,7 +302,8 @@ class DmaChannel:
         self.ControlValue |= 0x4
         
     def SetWordTransfer(self):
-        self.ControlValue |= 0xC
+        self.ControlValue  &= ~ 0xC
+        self.ControlValue |= 0x8
     
     def SetReadIncr(self):
         # Read address increments when bit 4 of the control value is set
@@ -152,10 +325,146 @@ class DmaChannel:
         # Set the TReq source to the given value (bits 15-20 of the control word)
         self.ControlValue = (self.ControlValue & ~ (0x3f << 15)) | ((value & 0x3f) << 15)
 
+    def SetRing(self, sizeBits, write=False):
+        # Wrap the read (or write) address at a 2^sizeBits byte boundary - the buffer must be aligned to its size
+        self.ControlValue = (self.ControlValue & ~ (0x1f << 6)) | ((sizeBits & 0xf) << 6) | ((1 if write else 0) << 10)
+
+    def NoRing(self):
+        self.SetRing(0)
+
+    def SetHighPriority(self, high=True):
+        self.ControlValue = (self.ControlValue & ~ CTRL_HIGH_PRIORITY) | (CTRL_HIGH_PRIORITY if high else 0)
+
+    def SetByteSwap(self, swap=True):
+        self.ControlValue = (self.ControlValue & ~ CTRL_BSWAP) | (CTRL_BSWAP if swap else 0)
+
+    def SetSniff(self, enable=True):
+        # Feed this channel's transfers through the sniffer, if it is attached to the channel
+        self.ControlValue = (self.ControlValue & ~ CTRL_SNIFF_EN) | (CTRL_SNIFF_EN if enable else 0)
+
+    def SetIRQ(self, enable=True):
+        # Raise DMA_IRQ_0 (and set the raw INTR bit) at the end of each transfer
+        self.ControlValue = (self.ControlValue & ~ CTRL_IRQ_QUIET) | (0 if enable else CTRL_IRQ_QUIET)
+        _write(DMA_INTE0 + (ATOMIC_SET if enable else ATOMIC_CLEAR), self.ChannelMask)
+
+    @micropython.viper                             # type: ignore
+    def IRQPending(self) -> bool:                  # type: ignore
+        return (ptr32(DMA_INTR)[0] & int(self.ChannelMask)) != 0 # type: ignore
+
+    def AckIRQ(self):
+        _write(DMA_INTS0, self.ChannelMask)
+
+    def Compile(self, readAddress, writeAddress, count, controlValue=None):
+        """ Build the register values for a transfer so that it can be started repeatedly with dma.arm()
+
+        Args:
+            readAddress (int):              Address (or buffer) to read from
+            writeAddress (int):             Address (or buffer) to write to
+            count (int):                    Number of transfers of the configured data size
+            controlValue (int, optional):   Control word to use. Defaults to the current ControlValue.
+
+        Returns:
+            array: READ_ADDR, WRITE_ADDR, TRANS_COUNT, CTRL and the channel's base address
+        """
+        if controlValue is None:
+            controlValue = self.ControlValue
+        return array("I", [_address(readAddress), _address(writeAddress), count, controlValue, self.ChannelBase])
+
+    def Arm(self, transfer):
+        # As dma.arm(), but recording the start time if timing is enabled
+        if self.Timing is not None:
+            self.Timing.Armed(transfer)
+        arm(transfer)
+
+    def EnableTiming(self, depth=32, budgetUs=0, elementUs=0):
+        """ Start timing every transfer started with Arm() (or Fill(), Copy() and Checksum()) - not SetChannelData() or
+        the Retrigger...() methods, which write the registers directly
+
+        Args:
+            depth (int, optional):      Number of recent durations to keep. Defaults to 32.
+            budgetUs (int, optional):   Transfers taking longer than this are counted as late, 0 to disable. Defaults to 0.
+            elementUs (int, optional):  Longest expected wait for the next element of a paced transfer - polls finding
+                                        no progress for longer count as stalls. Defaults to 0 (unpaced).
+
+        Returns:
+            DmaTiming: The statistics, also available as the Timing attribute
+        """
+        self.Timing = DmaTiming(self, depth, budgetUs, elementUs)
+        return self.Timing
+
+    def DisableTiming(self):
+        self.Timing = None
+
+    def Fill(self, dest, value, count, wait=True, size=SIZE_WORD):
+        """ Set count words at dest to value, as fast as the bus allows - the DMA equivalent of memset()
+
+        Args:
+            dest (int):             Address (or buffer) of the first word to write - must be aligned to the size
+            value (int):            The 32 bit value to write - only the low byte or halfword for smaller sizes
+            count (int):            The number of words (or bytes or halfwords) to write
+            wait (bool, optional):  Wait for the fill to complete before returning. Defaults to True.
+            size (int, optional):   Transfer size: SIZE_BYTE, SIZE_HALFWORD or SIZE_WORD. Defaults to SIZE_WORD.
+        """
+        self._fillWord[0] = value
+        transfer    = self._transfer
+        transfer[0] = addressof(self._fillWord)             # Little endian, so smaller sizes read the low bits
+        transfer[1] = _address(dest)
+        transfer[2] = count
+        transfer[3] = (_FILL_CONTROL & ~(3 << CTRL_DATA_SIZE)) | (size << CTRL_DATA_SIZE) | (self.ChannelNumber << CTRL_CHAIN_TO)
+        self.Arm(transfer)
+        if wait:
+            self.WaitForCompletion()
+
+    def Copy(self, dest, source, count, wait=True):
+        """ Copy count words from source to dest, as fast as the bus allows - the DMA equivalent of memcpy()
+
+        Args:
+            dest (int):             Address (or buffer) to copy to - must be word aligned
+            source (int):           Address (or buffer) to copy from - must be word aligned
+            count (int):            The number of words to copy
+            wait (bool, optional):  Wait for the copy to complete before returning. Defaults to True.
+        """
+        transfer    = self._transfer
+        transfer[0] = _address(source)
+        transfer[1] = _address(dest)
+        transfer[2] = count
+        transfer[3] = _COPY_CONTROL | (self.ChannelNumber << CTRL_CHAIN_TO)
+        self.Arm(transfer)
+        if wait:
+            self.WaitForCompletion()
+
+    def Checksum(self, source, count, mode=SNIFF_CRC32, size=SIZE_BYTE):
+        """ Calculate a checksum of a buffer by reading it through the sniffer - no CPU time is spent on the calculation
+
+        Args:
+            source (int):           Address (or buffer) of the data
+            count (int):            Number of transfers (of the given size) to checksum
+            mode (tuple, optional): One of the SNIFF_... modes. Defaults to SNIFF_CRC32.
+            size (int, optional):   Transfer size: SIZE_BYTE, SIZE_HALFWORD or SIZE_WORD. Defaults to SIZE_BYTE.
+
+        Raises:
+            RuntimeError: The sniffer is already in use
+
+        Returns:
+            int: The checksum
+        """
+        resources.claim_sniffer(owner=f"DMA{self.ChannelNumber} checksum")
+        try:
+            sniffer_attach(self, mode)
+            transfer    = self._transfer
+            transfer[0] = _address(source)
+            transfer[1] = addressof(self._fillWord)
+            transfer[2] = count
+            transfer[3] = _SNIFF_CONTROL | (size << CTRL_DATA_SIZE) | (self.ChannelNumber << CTRL_CHAIN_TO)
+            self.Arm(transfer)
+            self.WaitForCompletion()
+            return sniffer_result()
+        finally:
+            sniffer_detach()
+            resources.release_sniffer()
+
     @micropython.viper                                  # type: ignore
     def SetChannelData(self, readAddress : uint , writeAddress : uint, count: uint, trigger : bool):       # type: ignore
-        #print(f"Setup... Read: 0x{readAddress:08x} Write: 0x{writeAddress:08x} Count: {count}")
-
         # Disable the DMA channel first
         control = ptr32(self.ControlRegister)           # type: ignore
         control[0] = 0
@@ -169,12 +478,206 @@ class DmaChannel:
         wr_ptr[0] = writeAddress
         tc_ptr[0] = count
 
-        #print(f"Readback Read: 0x{rd_ptr[0]:08x} Write: 0x{wr_ptr[0]:08x} Count: {tc_ptr[0]}")
-
         if trigger:
             ctrl_ptr    = ptr32(self.TriggerControlRegister)      # type: ignore
             ctrl_ptr[0] = uint(self.ControlValue)                 # type: ignore
-            #print(f"Triggered with CTRL word 0x{self.ControlValue:08x}")
 
-        u_ptr = ptr8(readAddress)      # type: ignore
-        #print(f"Data from 0x{readAddress:08x}: {u_ptr[0]: 3} {u_ptr[1]: 3} {u_ptr[2]: 3} {u_ptr[3]: 3} {u_ptr[4]: 3} {u_ptr[5]: 3} {u_ptr[6]: 3} {u_ptr[7]: 3}")
+    @micropython.viper                                  # type: ignore
+    def RetriggerRead(self, readAddress: uint):         # type: ignore
+        """ Restart the last transfer from a new read address, with a single write to alias 3's READ_ADDR_TRIG. The
+        control word, the write address and the transfer count (which reloads on every trigger) are left as they were,
+        so this suits a channel which has finished feeding a fixed write address, such as a PIO FIFO. Not timed. """
+        ptr32(self.ChannelBase + AL3_READ_ADDR_TRIG)[0] = readAddress           # type: ignore
+
+    @micropython.viper                                  # type: ignore
+    def RetriggerWrite(self, writeAddress: uint):       # type: ignore
+        """ As RetriggerRead(), for a finished channel reading from a fixed address - a single write to alias 2's
+        WRITE_ADDR_TRIG """
+        ptr32(self.ChannelBase + AL2_WRITE_ADDR_TRIG)[0] = writeAddress         # type: ignore
+
+def _address(target):
+    # Accept either an address or anything with the buffer protocol
+    return target if isinstance(target, int) else addressof(target)
+
+@micropython.viper                                  # type: ignore
+def _write(address: uint, value: uint):             # type: ignore
+    ptr32(address)[0] = value                       # type: ignore
+
+class DmaTiming:
+    """ Timing statistics for the transfers made by one DMA channel
+
+    The start of each transfer is timestamped by DmaChannel.Arm(). There is no MicroPython handler for the DMA interrupt,
+    so completion is spotted by polling BUSY: in WaitForCompletion(), when the channel is next armed, or by calling Poll()
+    from the main loop. Durations are therefore only as accurate as the polling interval.
+
+    Overruns are transfers re-armed while the previous one was still running - the data is being produced faster than
+    it can be sent. Stalls are polls which found the channel busy and no further through its transfer count for longer
+    than elementUs, the longest a transfer should ever wait for its next element. For an unpaced channel that is 0, but
+    a DREQ-paced one is expected to wait: a DMX transmitter sends a byte every 44us (after a break of over 100us), and a
+    DMX receiver waits for the next frame to start. The first poll after each Armed() only notes the transfer count.
+    """
+    def __init__(self, channel, depth=32, budgetUs=0, elementUs=0):
+        self._channel   = channel
+        self._budget    = budgetUs
+        self._elementUs = elementUs
+        self._progressAt = None                        # When the transfer count was last seen to change
+        self.Durations  = array("I", [0] * depth)      # Most recent transfer durations in microseconds (a ring buffer)
+        self._next      = 0
+        self._armedAt   = None
+        self._count     = 0
+        self._size      = 1
+        self._remaining = 0
+        self.Reset()
+
+    def Reset(self):
+        self.Transfers  = 0
+        self.Overruns   = 0
+        self.Stalls     = 0
+        self.Late       = 0
+        self.MinUs      = 0
+        self.MaxUs      = 0
+        self._totalUs   = 0
+        self._bytes     = 0
+
+    def Armed(self, transfer):
+        # Called just before the channel is started with the compiled transfer
+        if not self.Poll() and self._armedAt is not None:
+            self.Overruns += 1
+        self._armedAt   = ticks_us()
+        self._count     = transfer[2]
+        self._size      = 1 << ((transfer[3] >> CTRL_DATA_SIZE) & 3)
+        self._remaining = transfer[2]
+        self._progressAt = None
+
+    def Poll(self):
+        """ Check whether the current transfer has completed, recording its duration if so
+
+        Returns:
+            bool: True if a transfer completed since the last poll
+        """
+        if self._armedAt is None:
+            return False
+
+        if self._channel.IsBusy():
+            now       = ticks_us()
+            remaining = self._channel.TransferCount()
+            if self._progressAt is None or remaining != self._remaining:
+                self._remaining  = remaining
+                self._progressAt = now
+            elif ticks_diff(now, self._progressAt) > self._elementUs:
+                self.Stalls     += 1
+                self._progressAt = now                 # Count each stalled interval once, however often it is polled
+            return False
+
+        duration = ticks_diff(ticks_us(), self._armedAt)
+        self._armedAt = None
+
+        self.Durations[self._next] = duration
+        self._next = (self._next + 1) % len(self.Durations)
+
+        if self.Transfers == 0 or duration < self.MinUs:
+            self.MinUs = duration
+        if duration > self.MaxUs:
+            self.MaxUs = duration
+        if self._budget and duration > self._budget:
+            self.Late += 1
+        self.Transfers += 1
+        self._totalUs  += duration
+        self._bytes    += self._count * self._size
+        return True
+
+    def AverageUs(self):
+        return self._totalUs / self.Transfers if self.Transfers else 0
+
+    def Throughput(self):
+        """ Bytes per second while transfers were running """
+        return self._bytes * 1_000_000 / self._totalUs if self._totalUs else 0
+
+    def __str__(self):
+        return (f"DMA{self._channel.ChannelNumber}: {self.Transfers} transfers, {self.MinUs}/{self.AverageUs():.0f}/{self.MaxUs}us min/avg/max, "
+                f"{self.Throughput():.0f} bytes/s, {self.Overruns} overruns, {self.Late} late, {self.Stalls} stalls")
+
+class DmaControlBlocks:
+    """ A list of transfers executed one after another by a worker channel, without any help from the CPU
+
+    Each control block is four words - READ_ADDR, WRITE_ADDR, TRANS_COUNT and CTRL - in the order of the worker's alias 0
+    registers. A loader channel copies one block at a time into those registers, the final write to CTRL_TRIG starting
+    the worker, and each block's CTRL chains the worker back to the loader to fetch the next one. The list is ended by an
+    all-zero block, whose write to CTRL_TRIG is a null trigger which leaves the worker idle (and raises its IRQ if
+    IRQ_QUIET is set).
+
+    This is the chained-reload trick from reference/AWG_v1.py generalised to any number of segments, for example a frame
+    header followed by its body, or several LED strips.
+    """
+    def __init__(self, loader, worker, maxBlocks):
+        """ Create an empty control block list
+
+        Args:
+            loader (DmaChannel):    The channel which loads each block into the worker
+            worker (DmaChannel):    The channel which performs the transfers
+            maxBlocks (int):        The largest number of blocks which will be added
+        """
+        self._loader  = loader
+        self._worker  = worker
+        self._blocks  = array("I", [0] * (4 * (maxBlocks + 1)))     # +1 for the terminating null block
+        self._count   = 0
+        self._end     = None                                        # Loader read address once the list has finished
+
+        # Word copies, read address incrementing, write address wrapping around the worker's four alias 0 registers
+        control = (CTRL_EN | CTRL_HIGH_PRIORITY | (SIZE_WORD << CTRL_DATA_SIZE) | CTRL_INCR_READ | CTRL_INCR_WRITE |
+                   (4 << CTRL_RING_SIZE) | CTRL_RING_SEL | (loader.ChannelNumber << CTRL_CHAIN_TO) |
+                   (TREQ_UNPACED << CTRL_TREQ_SEL) | CTRL_IRQ_QUIET)
+        self._start = loader.Compile(self._blocks, worker.ChannelBase, 4, control)
+
+    def Add(self, readAddress, writeAddress, count, controlValue=None):
+        """ Append a transfer to the list
+
+        Args:
+            readAddress (int):              Address (or buffer) to read from
+            writeAddress (int):             Address (or buffer) to write to
+            count (int):                    Number of transfers of the data size set in the control word
+            controlValue (int, optional):   The worker's control word for this block. Defaults to its ControlValue.
+                                            The channel is always enabled and chained back to the loader.
+
+        Raises:
+            ValueError: There is no room for another block
+        """
+        if 4 * (self._count + 2) > len(self._blocks):
+            raise ValueError("Control block list is full")
+
+        if controlValue is None:
+            controlValue = self._worker.ControlValue
+        controlValue = (controlValue & ~ (0xf << CTRL_CHAIN_TO)) | (self._loader.ChannelNumber << CTRL_CHAIN_TO) | CTRL_EN
+
+        block = 4 * self._count
+        self._blocks[block + 0] = _address(readAddress)
+        self._blocks[block + 1] = _address(writeAddress)
+        self._blocks[block + 2] = count
+        self._blocks[block + 3] = controlValue
+        for word in range(4):
+            self._blocks[block + 4 + word] = 0                      # Keep the list terminated
+        self._count += 1
+
+    def Clear(self):
+        self._count = 0
+        for word in range(4):
+            self._blocks[word] = 0
+
+    def Blocks(self):
+        """ The control blocks, including the terminating null block """
+        return memoryview(self._blocks)[:4 * (self._count + 1)]
+
+    def Start(self):
+        """ Run the list from the first block - the blocks must not be changed until it has finished """
+        self._end = addressof(self._blocks) + 16 * (self._count + 1)
+        arm(self._start)
+
+    def IsBusy(self):
+        # Both channels are briefly idle as each block chains to the next, so also check the null block has been loaded
+        if self._end is None:
+            return False
+        return self._loader.ReadAddress() != self._end or self._loader.IsBusy() or self._worker.IsBusy()
+
+    def WaitForCompletion(self):
+        while self.IsBusy():
+            pass
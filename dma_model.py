@@ -0,0 +1,142 @@
+# A host-side model of the RP2040 DMA registers, used to check that chained DMA set-ups such as dma.DmaControlBlocks
+# perform their transfers in the intended order. Plain Python only, so it runs under CPython as well as on the Pico.
+#
+# The model is deliberately simple: every channel is treated as unpaced and completes its whole transfer as soon as it
+# is triggered, one channel at a time. Writes which land on DMA registers (including those made by a DMA channel) are
+# decoded exactly as the hardware does, including the four register aliases, null triggers, ring wrapping, transfer
+# count reload and chaining.
+#
+# Run this file directly to check a control block list built the same way as dma.DmaControlBlocks.
+
+DMA_BASE          = 0x50000000
+DMA_CHANNELS      = 12
+DMA_MULTI_TRIGGER = DMA_BASE + 0x430
+
+# For each alias, the register at offsets 0x0, 0x4, 0x8 and 0xC - the last is the trigger
+_ALIASES = (("read", "write", "count", "ctrl"),
+            ("ctrl", "read",  "write", "count"),
+            ("ctrl", "count", "read",  "write"),
+            ("ctrl", "write", "count", "read"))
+
+class DmaModel:
+    def __init__(self):
+        self.memory   = {}                                  # Byte address -> value, anything unwritten reads as zero
+        self.channels = [{"read": 0, "write": 0, "count": 0, "ctrl": 0} for _ in range(DMA_CHANNELS)]
+        self.log      = []                                  # (channel, read, write, count, ctrl) for every transfer run
+        self.null_triggers = []                             # Channels which received a null trigger
+        self._pending = []
+
+    def read(self, address, size=4):
+        return sum(self.memory.get(address + n, 0) << (8 * n) for n in range(size))
+
+    def write(self, address, value, size=4):
+        """ Write to memory or, if the address is a DMA register, to the register - running any triggered channels """
+        if size == 4 and self._register_write(address, value):
+            return
+        for n in range(size):
+            self.memory[address + n] = (value >> (8 * n)) & 0xff
+
+    def load_words(self, address, words):
+        for n, word in enumerate(words):
+            self.write(address + 4 * n, word)
+
+    def run(self):
+        # Run triggered channels until nothing is left to do
+        while self._pending:
+            self._transfer(self._pending.pop(0))
+
+    def _register_write(self, address, value):
+        if address == DMA_MULTI_TRIGGER:
+            for channel in range(DMA_CHANNELS):
+                if value & (1 << channel):
+                    self._trigger(channel)
+            return True
+
+        offset = address - DMA_BASE
+        if offset < 0 or offset >= DMA_CHANNELS * 0x40:
+            return False
+
+        channel  = offset // 0x40
+        alias    = (offset % 0x40) // 0x10
+        position = (offset % 0x10) // 4
+        register = _ALIASES[alias][position]
+
+        if position == 3 and value == 0:
+            # A null trigger - the register is written but the channel does not start
+            self.channels[channel][register] = 0
+            self.null_triggers.append(channel)
+            return True
+
+        self.channels[channel][register] = value & 0xffffffff
+        if position == 3:
+            self._trigger(channel)
+        return True
+
+    def _trigger(self, channel):
+        if self.channels[channel]["ctrl"] & 1:
+            self._pending.append(channel)
+
+    def _transfer(self, channel):
+        regs  = self.channels[channel]
+        ctrl  = regs["ctrl"]
+        size  = 1 << ((ctrl >> 2) & 3)
+        ring  = (ctrl >> 6) & 0xf
+        count = regs["count"]                               # TRANS_COUNT reloads to the last value written
+        self.log.append((channel, regs["read"], regs["write"], count, ctrl))
+
+        read, write = regs["read"], regs["write"]
+        for _ in range(count):
+            self.write(write, self.read(read, size), size)
+            if ctrl & (1 << 4):
+                read  = _step(read,  size, ring if not ctrl & (1 << 10) else 0)
+            if ctrl & (1 << 5):
+                write = _step(write, size, ring if ctrl & (1 << 10) else 0)
+
+        # Only update the addresses if the transfer didn't reprogram its own channel
+        if regs["ctrl"] == ctrl:
+            regs["read"], regs["write"] = read, write
+
+        chain = (ctrl >> 11) & 0xf
+        if chain != channel:
+            self._trigger(chain)
+
+def _step(address, size, ring):
+    if ring == 0:
+        return address + size
+    mask = (1 << ring) - 1
+    return (address & ~mask) | ((address + size) & mask)
+
+def check_control_blocks():
+    """ Build a three segment control block list as dma.DmaControlBlocks does, and check the worker runs each in turn """
+    loader, worker = 2, 3
+    blocks_at      = 0x20001000
+    worker_base    = DMA_BASE + worker * 0x40
+
+    # Worker: word copies, both addresses incrementing, unpaced, chained back to the loader
+    worker_ctrl = 1 | (2 << 2) | (1 << 4) | (1 << 5) | (loader << 11) | (0x3f << 15) | (1 << 21)
+    segments    = [(0x20002000, 0x20003000, 4), (0x20002100, 0x20003010, 2), (0x20002200, 0x20003018, 8)]
+    blocks      = []
+    for read, write, count in segments:
+        blocks += [read, write, count, worker_ctrl]
+    blocks += [0, 0, 0, 0]
+
+    model = DmaModel()
+    model.load_words(blocks_at, blocks)
+    for n, (read, _, count) in enumerate(segments):
+        model.load_words(read, [(n << 16) | word for word in range(count)])
+
+    # Loader: four words, read incrementing, write wrapping around the worker's alias 0 registers (16 byte ring)
+    loader_ctrl = 1 | (2 << 2) | (1 << 4) | (1 << 5) | (4 << 6) | (1 << 10) | (loader << 11) | (0x3f << 15) | (1 << 21)
+    model.channels[loader].update(read=blocks_at, write=worker_base, count=4, ctrl=loader_ctrl)
+    model.write(DMA_MULTI_TRIGGER, 1 << loader)
+    model.run()
+
+    worker_runs = [entry[1:4] for entry in model.log if entry[0] == worker]
+    assert worker_runs == segments, f"Worker ran {worker_runs}, expected {segments}"
+    assert model.null_triggers == [worker], "Control block list was not terminated by a null trigger"
+    for n, (_, write, count) in enumerate(segments):
+        assert [model.read(write + 4 * word) for word in range(count)] == [(n << 16) | word for word in range(count)]
+    print(f"Control blocks OK: {len(segments)} segments in order, {len(model.log)} DMA transfers")
+
+if __name__ == "__main__":
+    check_control_blocks()
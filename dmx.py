@@ -1,9 +1,12 @@
 import rp2                            # type: ignore
 from machine import Pin, Timer        # type: ignore 
 
-from uctypes import addressof         # type: ignore
 
 import dma
+import pio
+import resources
+
+from dma import arm
 
 # Interface to a DMX universe for sending using a PIO module.
 
@@ -22,8 +25,9 @@ import dma
 #     When used as a receiver, each received universe is copied and made available to the user as soon as it is received.
 
 # DMA Channel and PIO allocations:
-#     It is not possible to check the hardware to see if a DMA channel or PIO statemachine is already in use. No extra locking
-#     has been added in this software, thus clashes need to be avoided by the user code.
+#     It is not possible to check the hardware to see if a DMA channel or PIO statemachine is already in use, so both are
+#     claimed from the registry in resources.py, and released again by deinit(). Asking for a resource which is already in
+#     use raises a RuntimeError.
 
 # Links to original references:
 # DMX in C++ with PIO and DMA: https://github.com/jostlowe/Pico-DMX
@@ -40,6 +44,12 @@ import dma
 #
 # DMX timing: https://support.etcconnect.com/ETC/FAQ/DMX_Speed
 
+def _release(smnumber, dmanumber):
+    # Release the claims made by a constructor which failed part way through - dmanumber is None if it wasn't reached
+    resources.release_statemachine(smnumber)
+    if dmanumber is not None:
+        resources.release_dma(dmanumber)
+
 class DMX_TX:
     """ Interface to a DMX universe for sending using a PIO module.
     Transmission:
@@ -58,17 +68,18 @@ class DMX_TX:
     """
     from dmx_asm import dmx_out
 
-    def __init__(self, pin, universe_size=512, statemachine=0, dmachannel=0):
+    def __init__(self, pin, universe_size=512, statemachine=None, dmachannel=None):
         """ Initialisation of the DMX controller PIO statemachine and DMA channel
 
         Args:
             pin (numeric):                  Pin number to use
             universe_size (int, optional):  Size of the DMX universe to interface to. Defaults to 512.
-            statemachine (int, optional):   Which PIO statemachine should be used. Defaults to 0.
-            dmachannel (int, optional):     Which DMA channel should be used. Defaults to 0.
+            statemachine (int, optional):   Which PIO statemachine should be used. Defaults to None (any free statemachine).
+            dmachannel (int, optional):     Which DMA channel should be used. Defaults to None (any free channel).
 
         Raises:
-            ValueError: Any invalid parameters are reported as exceptions
+            ValueError:   Any invalid parameters are reported as exceptions
+            RuntimeError: The statemachine or DMA channel is already in use
 
         TODO: Allow the interbyte delay to be specified
         TODO: Allow the inter-packet delay to be specified (or is the rate good enough?)
@@ -78,40 +89,69 @@ class DMX_TX:
         
         self.channels       = bytearray([0 for _ in range(universe_size+1)]) # +1 because DMX-0 is the start code, with channels 1-512 behind it
 
-        self._pin           = Pin(pin, Pin.OUT, Pin.PULL_UP)
-        self._sm            = rp2.StateMachine(statemachine, 
+        self._sm            = None
+        self._smnumber      = resources.claim_statemachine(statemachine, DMX_TX.dmx_out, owner=f"DMX_TX on pin {pin}")
+        self._dmanumber     = None
+        try:
+            self._dmanumber = resources.claim_dma(dmachannel, owner=f"DMX_TX on pin {pin}")
+
+            self._pin       = Pin(pin, Pin.OUT, Pin.PULL_UP)
+            self._sm        = rp2.StateMachine(self._smnumber, 
                                                prog=DMX_TX.dmx_out, 
                                                freq=1_000_000, 
                                                sideset_base=self._pin, 
                                                out_base=self._pin)
-        self._dma           = dma.DmaChannel(dmachannel)
+        except:
+            # Release whatever was claimed before the failure, rather than losing it until the next reset
+            _release(self._smnumber, self._dmanumber)
+            raise
+        self._dma           = dma.DmaChannel(self._dmanumber)
 
         # Set up the DMA controller
         self._dma.NoWriteIncr()
-        self._dma.SetTREQ(0) # TODO - hard coded as PIO0 TX0
+        self._dma.SetTREQ(pio.tx_dreq(self._smnumber))
+
+        # The transfer is the same every time, so build the register values once
+        self._transfer = self._dma.Compile(self.channels, pio.tx_fifo(self._smnumber), len(self.channels))
+        self._frame    = self._transfer[0]
 
     def start(self, period = 50):
         """ Start sending DMX packets
 
         Args:
-            period (int, optional): Start sending a new packet every period milliseconds. Defaults to 50.
+            period (int, optional): Start sending a new packet every period milliseconds. Defaults to 50. A full
+                                    universe takes about 23ms to send, and must have finished before the next starts.
         """
         self.timer_count = 0
+        dma.load(self._transfer)    # Each restart then only has to write the read address, which triggers the channel
         self.t = Timer(period=period, callback=self.restart)
 
     def pause(self):
         self.t.deinit()
         self._sm.active(0)
 
+    def deinit(self):
+        """ Stop sending and release the statemachine and DMA channel """
+        if self._sm is None:
+            return
+        if hasattr(self, "t"):
+            self.t.deinit()
+        self._dma.SetControlRegister(0)
+        resources.release_statemachine(self._smnumber)
+        resources.release_dma(self._dmanumber)
+        self._sm = None
+
     def restart(self, t):
         self._sm.active(1)
         self._sm.restart()
-        self._dma.SetChannelData(addressof(self.channels), 0x50200010, len(self.channels), True) # TODO Hard coded as PIO0 for now
+        if self._dma.Timing is None:
+            self._dma.RetriggerRead(self._frame)
+        else:
+            self._dma.Arm(self._transfer)
         self.timer_count += 1
    
     def __del__(self):
-        # TODO - tidy up the state machine and DMA channels
-        pass
+        self.deinit()
         
     #def __repr__(self):
         # TODO - encode the class state - including which PIO and DMA channel are in use
@@ -162,50 +202,63 @@ class DMX_RX:
         The DMA accepts each byte from the PIO and stores it in memory. If too many bytes are received (should be impossible), the DMA stops
 
     DMA Channel and PIO allocations:
-        It is not possible to check the hardware to see if a DMA channel or PIO statemachine is already in use. No extra locking
-        has been added in this software, thus clashes need to be avoided by the user code.
+        Both are claimed from the registry in resources.py, and released again by deinit().
     """
 
     from dmx_asm import dmx_in
 
-    def __init__(self, pin, statemachine=4, dmachannel=1, num_channels=512):
+    def __init__(self, pin, statemachine=None, dmachannel=None, num_channels=512):
         """ Initialisation of the DMX controller
 
         Args:
             pin (numeric):                  Pin number to use
-            statemachine (int, optional):   Which PIO statemachine should be used. Defaults to 4.
-            dmachannel (int, optional):     Which DMA channel should be used. Defaults to 1.
+            statemachine (int, optional):   Which PIO statemachine should be used. Defaults to None (any free statemachine).
+            dmachannel (int, optional):     Which DMA channel should be used. Defaults to None (any free channel).
             num_channels (int, optional):   The number of DMX channels expected. Defaults to 512. 
             
             Note that if shorter frames are being received AND the DMX BREAK is close to the minimum permitted, a race condition exists which may cause
             data corruption.
 
         Raises:
-            ValueError: Any invalid parameters are reported as exceptions
+            ValueError:   Any invalid parameters are reported as exceptions
+            RuntimeError: The statemachine or DMA channel is already in use
         """
         self.channels   = bytearray([0 for _ in range(num_channels+1)]) # DMX-0 is the start code, with channels 1-512 behind it
         
-        self._pin       = Pin(pin, Pin.IN)
-
-        self._debugpin  = Pin(12, Pin.OUT, Pin.PULL_UP) # TODO Temporary hard coded debug pins (12 + 13 used)
-
-        self._sm = rp2.StateMachine(statemachine, 
-                                    prog=DMX_RX.dmx_in, 
-                                    freq=1_000_000,
-                                    in_base=self._pin, 
-                                    jmp_pin=self._pin,
-                                    sideset_base=self._debugpin)
+        self._sm        = None
+        self._smnumber  = resources.claim_statemachine(statemachine, DMX_RX.dmx_in, owner=f"DMX_RX on pin {pin}")
+        self._dmanumber = None
+        try:
+            self._dmanumber = resources.claim_dma(dmachannel, owner=f"DMX_RX on pin {pin}")
+
+            self._pin       = Pin(pin, Pin.IN)
+
+            self._debugpin  = Pin(12, Pin.OUT, Pin.PULL_UP) # TODO Temporary hard coded debug pins (12 + 13 used)
+
+            self._sm = rp2.StateMachine(self._smnumber, 
+                                        prog=DMX_RX.dmx_in, 
+                                        freq=1_000_000,
+                                        in_base=self._pin, 
+                                        jmp_pin=self._pin,
+                                        sideset_base=self._debugpin)
+        except:
+            # Release whatever was claimed before the failure, rather than losing it until the next reset
+            _release(self._smnumber, self._dmanumber)
+            raise
         self._sm.irq(handler=self.IRQ_from_PIO)
         self.frames_received = 0
         
-        self._dma = dma.DmaChannel(dmachannel)
+        self._dma = dma.DmaChannel(self._dmanumber)
         self._dma.NoReadIncr()
-        self._dma.SetTREQ(dma.TREQ_PIO4_RX)
-        #self._dma.SetTREQ(12) # TODO - hard coded as PIO4 TX for the moment
+        self._dma.SetTREQ(pio.rx_dreq(self._smnumber))
+
+        # The transfer is restarted by every IRQ, so build the register values once. The PIO shifts right, leaving each 
+        # byte in the top lane of the FIFO word, so read from +3 rather than shifting
+        self._transfer = self._dma.Compile(pio.rx_fifo(self._smnumber, lane=3), self.channels, len(self.channels))
 
 
     def start(self):
-        self._dma.SetChannelData(0x50300023, addressof(self.channels), len(self.channels), True) # TODO Hard coded as PIO4 RX +3 (LSB byte without shifting)
+        self._dma.Arm(self._transfer)
         self._sm.restart()
         self._sm.put(len(self.channels)-1)    # Set the length of the DMX frame we expect
         self._sm.active(1)
@@ -213,9 +266,18 @@ class DMX_RX:
     def pause(self):
         self._sm.active(0)
 
+    def deinit(self):
+        """ Stop receiving and release the statemachine and DMA channel """
+        if self._sm is None:
+            return
+        self._sm.irq(handler=None)
+        self._dma.SetControlRegister(0)
+        resources.release_statemachine(self._smnumber)
+        resources.release_dma(self._dmanumber)
+        self._sm = None
+
     def __del__(self):
-        # TODO - tidy up the state machine and DMA channels
-        pass
+        self.deinit()
         
     def __repr__(self):
         # TODO - encode the class state - including which PIO and DMA channel are in use
@@ -243,7 +305,12 @@ class DMX_RX:
         return result
     
     def IRQ_from_PIO(self, sm):
-        self._dma.SetChannelData(0x50300023, addressof(self.channels), len(self.channels), True) # TODO Hard coded as PIO4 RX
+        # Restart the DMA before the next frame's data arrives - the viper arm() writes the registers directly. The
+        # DmaChannel wrapper is only worth its overhead when timing is enabled, as it records the start time.
+        if self._dma.Timing is None:
+            arm(self._transfer)
+        else:
+            self._dma.Arm(self._transfer)
         self.frames_received += 1
 
 def test():
@@ -298,4 +365,5 @@ def test():
     #    dmx_out.send(1,n)
     #    time.sleep_ms(200)
     
-    dmx_out.pause()
\ No newline at end of file
+    dmx_out.deinit()
+    dmx_in.deinit()
\ No newline at end of file
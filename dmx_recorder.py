@@ -0,0 +1,304 @@
+from time    import ticks_ms, ticks_diff, ticks_add   # type: ignore
+from uctypes import addressof                          # type: ignore
+
+# Record a DMX universe received by DMX_RX to flash, and play it back through DMX_TX.
+
+# File format:
+#     An 8 byte header: b"DMXR", format version (1), reserved (0), universe length (uint16, little endian - includes the
+#     start code). This is followed by a stream of records, one per received frame which changed any slot:
+#
+#         dt      uint16  Milliseconds since the previous record (or the start of the recording). Gaps longer than
+#                         65535ms are recorded as a series of empty records.
+#         length  uint16  Number of payload bytes following
+#         payload         A series of runs, each comprising: start slot (uint16), run length (uint8, 1...255), then the
+#                         values for that many consecutive slots. Gaps of up to three unchanged slots are folded into
+#                         the surrounding run as that is cheaper than starting a new one.
+#
+#     A run header costs three bytes, so a record can never be more than a few bytes longer than the universe itself.
+#     A full 513-slot universe in which every slot changes costs 4 + 513 + 9 = 526 bytes per frame.
+#
+# Flash writes:
+#     Records are assembled in a page-sized RAM buffer and only written to the filesystem once the buffer is full (or
+#     the recording stops). The DMA and PIO continue receiving while a record is encoded, but the RP2040 cannot service
+#     interrupts whilst the flash is being programmed, so batching keeps the number of stalls down to a handful a second
+#     even in the worst case:
+#
+#         Full 512-slot universe, every slot changing at 44Hz:  526 * 44 = 23.1 KB/s, 5.7 page (4KB) writes/s, 83MB/hour
+#         Typical show (~20 slots changing per frame at 44Hz):   ~30 * 44 = 1.3 KB/s, one page write every 3 seconds
+#         Static look:                                          nothing is written until something changes
+
+DMXR_MAGIC   = b"DMXR"
+DMXR_VERSION = 1
+MAX_DT       = 65535
+
+def max_record_size(universe_size):
+    """ The largest record (header plus payload) which can be produced for a universe of the given length """
+    return 4 + universe_size + 3 * (universe_size // 255 + 2)
+
+@micropython.viper                                                      # type: ignore
+def _encode_delta(current: ptr8, shadow: ptr8, n: int, out: ptr8) -> int:  # type: ignore
+    # Write runs of changed slots to out, updating the shadow copy as we go. Returns the number of bytes written.
+    pos  = 0
+    slot = 0
+    while slot < n:
+        if current[slot] == shadow[slot]:
+            slot += 1
+            continue
+
+        # Start a new run
+        out[pos]     = slot & 0xff
+        out[pos + 1] = slot >> 8
+        length_pos   = pos + 2
+        pos         += 3
+        length       = 0
+
+        while slot < n and length < 255:
+            if current[slot] == shadow[slot]:
+                # Bridge gaps of up to three unchanged slots - cheaper than the three byte header of a new run
+                gap = 1
+                while gap < 4 and slot + gap < n and current[slot + gap] == shadow[slot + gap]:
+                    gap += 1
+                if gap == 4 or slot + gap >= n or length + gap >= 255:
+                    break
+
+            value        = current[slot]
+            shadow[slot] = value
+            out[pos]     = value
+            pos         += 1
+            slot        += 1
+            length      += 1
+
+        out[length_pos] = length
+    return pos
+
+@micropython.viper                                                      # type: ignore
+def _apply_delta(payload: ptr8, length: int, channels: ptr8, n: int):   # type: ignore
+    # Copy each run in the payload into the channels, ignoring anything beyond the end of the universe
+    pos = 0
+    while pos < length:
+        slot  = payload[pos] | (payload[pos + 1] << 8)
+        count = payload[pos + 2]
+        pos  += 3
+        for i in range(count):
+            if slot + i < n:
+                channels[slot + i] = payload[pos + i]
+        pos += count
+
+class DMX_Recorder:
+    """ Record the frames received by a DMX_RX to a file as timestamped deltas
+
+    Call poll() regularly (at least once per DMX frame) from the main loop. Each new frame is compared with the previous
+    one and only the changed slots are stored. Records are batched into page-sized writes to limit the time spent with
+    the flash busy.
+    """
+    def __init__(self, dmx_in, filename, page_size=4096):
+        """ Prepare a recording - nothing is written until start() is called
+
+        Args:
+            dmx_in (DMX_RX):            The receiver to record from
+            filename (str):             The file to record into - any existing file is overwritten
+            page_size (int, optional):  Number of bytes to batch up before writing to flash. Defaults to 4096.
+
+        Raises:
+            ValueError: Any invalid parameters are reported as exceptions
+        """
+        self._dmx        = dmx_in
+        self._filename   = filename
+        self._size       = len(dmx_in.channels)
+        self._max_record = max_record_size(self._size)
+
+        if page_size < self._max_record:
+            raise ValueError(f"Page size must be at least {self._max_record} bytes")
+
+        self._shadow     = bytearray(self._size)
+        self._page       = bytearray(page_size)
+        self._used       = 0
+        self._file       = None
+        self._last_frame = 0
+        self._last_time  = 0
+
+        self.frames_recorded = 0
+        self.bytes_written   = 0
+        self.page_writes     = 0
+
+    def start(self):
+        """ Create the file and start recording from the next received frame """
+        self._file = open(self._filename, "wb")
+        header = bytearray(8)
+        header[0:4] = DMXR_MAGIC
+        header[4]   = DMXR_VERSION
+        header[6]   = self._size & 0xff
+        header[7]   = self._size >> 8
+        self._file.write(header)
+
+        # Every slot is recorded in the first frame
+        channels = self._dmx.channels
+        for slot in range(self._size):
+            self._shadow[slot] = channels[slot] ^ 0xff
+        self._used       = 0
+        self._last_frame = self._dmx.frames_received
+        self._last_time  = ticks_ms()
+
+        self.frames_recorded = 0
+        self.bytes_written   = 8
+        self.page_writes     = 0
+
+    def poll(self):
+        """ Record the latest frame if a new one has been received since the last call
+
+        Returns:
+            bool: True if a record was added to the log
+        """
+        frame = self._dmx.frames_received
+        if frame == self._last_frame or self._file is None:
+            return False
+        self._last_frame = frame
+
+        now = ticks_ms()
+        dt  = self._carry_gap(now)
+
+        # Make sure a whole record fits in the page buffer before encoding straight into it
+        if self._used + self._max_record > len(self._page):
+            self._flush()
+
+        length = _encode_delta(self._dmx.channels, self._shadow, self._size, addressof(self._page) + self._used + 4)
+        if length == 0:
+            return False                                  # Nothing changed - the time carries over to the next record
+
+        self._put_header(dt, length)
+        self._used     += 4 + length
+        self._last_time = now
+        self.frames_recorded += 1
+        return True
+
+    def stop(self):
+        """ Finish the recording, recording the time since the last change, and close the file """
+        if self._file is None:
+            return
+
+        self._add_empty(self._carry_gap(ticks_ms()))
+        self._flush()
+        self._file.close()
+        self._file = None
+
+    def _carry_gap(self, now):
+        # Bridge gaps too long for a single record with empty records, returning the time left over
+        dt = ticks_diff(now, self._last_time)
+        while dt > MAX_DT:
+            self._add_empty(MAX_DT)
+            self._last_time = ticks_add(self._last_time, MAX_DT)
+            dt -= MAX_DT
+        return dt
+
+    def _add_empty(self, dt):
+        if self._used + 4 > len(self._page):
+            self._flush()
+        self._put_header(dt, 0)
+        self._used += 4
+
+    def _put_header(self, dt, length):
+        page = self._page
+        used = self._used
+        page[used + 0] = dt & 0xff
+        page[used + 1] = dt >> 8
+        page[used + 2] = length & 0xff
+        page[used + 3] = length >> 8
+
+    def _flush(self):
+        if self._used:
+            self._file.write(memoryview(self._page)[:self._used])
+            self._file.flush()
+            self.bytes_written += self._used
+            self.page_writes   += 1
+            self._used          = 0
+
+    def __str__(self):
+        return f"Recorded {self.frames_recorded} frames, {self.bytes_written + self._used} bytes, {self.page_writes} page writes"
+
+class DMX_Player:
+    """ Play back a recording made by DMX_Recorder through a DMX_TX
+
+    Records are streamed from the file one at a time, so the RAM used is bounded by the size of the largest possible
+    record regardless of the length of the recording. Call poll() regularly, or play() to block until the end.
+    """
+    def __init__(self, dmx_out, filename):
+        """ Open a recording ready to play
+
+        Args:
+            dmx_out (DMX_TX):   The transmitter to play through - the recording is clipped to its universe size
+            filename (str):     The recording to play
+
+        Raises:
+            ValueError: The file is not a DMX recording
+        """
+        self._dmx      = dmx_out
+        self._filename = filename
+        self._file     = open(filename, "rb")
+
+        header = self._file.read(8)
+        if len(header) != 8 or header[0:4] != DMXR_MAGIC or header[4] != DMXR_VERSION:
+            self._file.close()
+            raise ValueError(f"{filename} is not a DMX recording")
+
+        size           = header[6] | (header[7] << 8)
+        self._header   = bytearray(4)
+        self._payload  = bytearray(max_record_size(size))
+        self._length   = 0
+        self._due      = 0
+        self._loop     = False
+        self._playing  = False
+
+        self.frames_played = 0
+
+    def start(self, loop=False):
+        """ Start playing from the beginning of the recording
+
+        Args:
+            loop (bool, optional): Restart from the beginning when the end is reached. Defaults to False.
+        """
+        self._loop    = loop
+        self._file.seek(8)
+        self._due     = ticks_ms()
+        self._playing = self._next()
+        self.frames_played = 0
+
+    def poll(self):
+        """ Send any frames which are now due
+
+        Returns:
+            bool: False once the end of the recording has been reached
+        """
+        while self._playing and ticks_diff(ticks_ms(), self._due) >= 0:
+            channels = self._dmx.channels
+            _apply_delta(self._payload, self._length, channels, len(channels))
+            self.frames_played += 1
+            self._playing = self._next()
+
+            if not self._playing and self._loop:
+                self._file.seek(8)
+                self._playing = self._next()
+        return self._playing
+
+    def play(self, loop=False):
+        """ Play the whole recording, returning when it has finished """
+        self.start(loop)
+        while self.poll():
+            pass
+
+    def stop(self):
+        self._playing = False
+        self._file.close()
+
+    def _next(self):
+        # Read the next record and work out when it is due. Returns False at the end of the file.
+        if self._file.readinto(self._header) != 4:
+            return False
+
+        dt     = self._header[0] | (self._header[1] << 8)
+        length = self._header[2] | (self._header[3] << 8)
+        if length > len(self._payload) or self._file.readinto(memoryview(self._payload)[:length]) != length:
+            return False                                  # Truncated or corrupt recording
+
+        self._length = length
+        self._due    = ticks_add(self._due, dt)
+        return True
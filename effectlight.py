@@ -1,5 +1,6 @@
 from dmx       import DMX_RX
-from led_panel import led_panel
+from led_panel import led_panel, scale_colour
+from time      import sleep_ms, ticks_ms, ticks_diff
 import _thread
 import gc
 
@@ -20,6 +21,72 @@ blue2         = 0
 
 thread_running = True
 
+IDLE_MS = 10    # How long the effect thread sleeps when a static effect has nothing new to show
+GAMMA   = None  # Gamma correction applied to the LEDs along with the brightness, such as 2.2, or None for none
+
+crossfade_ms = 1000 # How long a change of effect takes to fade from one to the next, 0 for a hard cut
+
+# The effects, looked up by the DMX mode value. Each entry is (render, prepare, animated) - see register_effect().
+_effects  = [None] * 256
+_current  = None        # The entry last rendered, the parameters it was prepared for, and what prepare returned
+_params   = None
+_prepared = None
+_outgoing = None        # The entry, prepared value and parameters of the effect being faded out, None if not fading
+_fade_start = 0
+
+def register_effect(first, last, render, prepare=None, animated=True):
+    """ Use an effect for the DMX mode values first...last inclusive, replacing whatever was there
+
+    Args:
+        first (int):                The first mode value, 0...255
+        last (int):                 The last mode value, first...255
+        render (callable):          Called as render(panel, prepared, params) to draw each frame, where params is the
+                                    tuple (red, green, blue, speed1, speed2, red2, green2, blue2). Effects draw at full
+                                    brightness - the panel applies the brightness channel as each frame is sent.
+        prepare (callable, optional): Called as prepare(panel, params) when the effect is selected or any parameter
+                                    changes, returning the value passed to render as prepared - anything worked out from
+                                    the parameters alone, such as the LED colour. Defaults to None (prepared is None).
+        animated (bool, optional):  The effect changes from frame to frame. A static effect is only rendered when it is
+                                    selected or a parameter changes, and sent to the LEDs then or when the brightness
+                                    changes. Defaults to True.
+
+    Raises:
+        ValueError: The range is invalid
+    """
+    if first < 0 or last > 255 or first > last:
+        raise ValueError("Effects must be registered for mode values within 0...255")
+    entry = (render, prepare, animated)
+    for mode in range(first, last + 1):
+        _effects[mode] = entry
+
+# The built in effects
+def _prepare_colour(panel, params):
+    # The LED colour - only worked out when a parameter changes
+    return scale_colour(255, params[0], params[1], params[2])
+
+def _solid(panel, colour, params):
+    panel.fill_colour(colour)
+
+def _beacon(panel, colour, params):
+    panel.beacon_colour(colour, params[3], params[4])           # speed1 = rotation speed, speed2 = rotation width
+
+def _strobe(panel, colour, params):
+    panel.strobe_colour(colour, params[3], params[4])           # speed1 = on time, speed2 = off time
+
+def _firelight(panel, prepared, params):
+    red, green, blue, speed1, speed2 = params[0], params[1], params[2], params[3], params[4]
+    panel.firelight(255, red, green, blue, speed1, speed2)      # speed1 = brightening, speed2 = fade
+
+def _heatfire(panel, prepared, params):
+    red, green, blue, speed1, speed2 = params[0], params[1], params[2], params[3], params[4]
+    panel.heatfire(255, red, green, blue, speed1, speed2)       # speed1 = sparking, speed2 = cooling
+
+register_effect(  0,  63, _solid,     _prepare_colour, animated=False)
+register_effect( 64, 127, _beacon,    _prepare_colour)
+register_effect(128, 191, _strobe,    _prepare_colour)
+register_effect(192, 223, _firelight)
+register_effect(224, 255, _heatfire)
+
 def run_effect_as_thread():
     # Start the firelight as a second thread
     print("Starting effect thread")
@@ -29,20 +96,64 @@ def run_effect():
     panel = led_panel(pin=27, width=32, height=32)
 
     while thread_running:
-        update_effect(panel)
+        if not update_effect(panel):
+            sleep_ms(IDLE_MS)
+    panel.deinit()
     print("Thread exiting")
 
 def update_effect(panel):
-    if effect < 64:     # Solid colour
-        panel.fill(brightness, red, green, blue) 
-    elif effect < 128:  # Beacon
-        panel.beacon(brightness, red, green, blue, speed1, speed2)
-    elif effect < 192:  # Strobe
-        panel.strobe(brightness, red, green, blue, speed1, speed2)
-    else:               # Firelight 
-        panel.firelight(brightness, red, green, blue, speed1, speed2)
+    """ Render the selected effect and send it to the LEDs - unless it is static and nothing has changed, when it
+    returns False having done nothing but let the panel finish sending the last frame. A change of brightness alone
+    only needs the last frame sending again.
+
+    When the effect changes, the panel crossfades to it over crossfade_ms, carrying on rendering the outgoing effect
+    on a second strip. A static effect on either side is only rendered once, leaving just the blend to do each frame.
+    Changing effect again mid-fade changes the incoming effect, fading on from the same outgoing one.
+    """
+    global _current, _params, _prepared, _outgoing, _fade_start
+
+    entry   = _effects[effect]
+    params  = (red, green, blue, speed1, speed2, red2, green2, blue2)
+    dimmed  = panel.set_output(brightness, GAMMA)
+    changed = entry is not _current or params != _params
+    if entry is not _current and _outgoing is None and crossfade_ms > 0 and panel.start_crossfade():
+        _outgoing   = (_current, _prepared, _params)
+        _fade_start = ticks_ms()
+    if changed:
+        _current = entry
+        _params  = params
+
+    fading = _outgoing is not None
+    if fading:
+        mix = (ticks_diff(ticks_ms(), _fade_start) * 256) // max(crossfade_ms, 1)
+        if mix < 256:
+            outgoing, prepared, previous = _outgoing
+            if outgoing is not None and outgoing[2]:
+                panel.swap_strips()
+                outgoing[0](panel, prepared, previous)
+                panel.swap_strips()
+        else:
+            _outgoing = None            # Finished - the blend is skipped from this frame on
+        panel.set_crossfade(mix)
+
+    if entry is None:       # Nothing registered for this mode - static black
+        if changed:
+            panel.fill_colour(0)
+        elif not (dimmed or fading):
+            panel.service()
+            return False
+    else:
+        render, prepare, animated = entry
+        if changed:
+            _prepared = prepare(panel, params) if prepare is not None else None
+        if changed or animated:
+            render(panel, _prepared, params)
+        elif not (dimmed or fading):
+            panel.service()
+            return False
 
     panel.update()
+    return True
 
 def test_effect(f, r, g, b, e, s1, s2, r2, g2, b2):
     global brightness # Overall brightness of the effect
@@ -53,7 +164,8 @@ def test_effect(f, r, g, b, e, s1, s2, r2, g2, b2):
                       #    000 - 063: Solid colour - no speed control
                       #    064 - 127: Beacon       - speed1 = rotation speed, speed2 = rotation width
                       #    128 - 191: Strobe       - speed1 = on time,        speed2 = off time
-                      #    192 - 254: Firelight    - speed1 = brightening,    speed2 = fade
+                      #    192 - 223: Firelight    - speed1 = brightening,    speed2 = fade
+                      #    224 - 255: Heat fire    - speed1 = sparking,       speed2 = cooling
     global speed1
     global speed2
     global red2
@@ -79,6 +191,7 @@ def test_effect(f, r, g, b, e, s1, s2, r2, g2, b2):
     brightness = 0
     effect = 0
     update_effect(panel)
+    panel.deinit()
 
 def start_effect(dmx_start):
     # Initialise the DMX receiver
@@ -98,7 +211,8 @@ def start_effect(dmx_start):
                               #    000 - 063: Solid colour - no speed control
                               #    064 - 127: Beacon       - speed1 = rotation speed, speed2 = rotation width
                               #    128 - 191: Strobe       - speed1 = on time,        speed2 = off time
-                              #    192 - 254: Firelight    - speed1 = brightening,    speed2 = fade
+                              #    192 - 223: Firelight    - speed1 = brightening,    speed2 = fade
+                              #    224 - 255: Heat fire    - speed1 = sparking,       speed2 = cooling
             global speed1
             global speed2
             global red2
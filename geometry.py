@@ -0,0 +1,84 @@
+import array
+
+# Mapping from x, y coordinates on an LED panel to positions in its strip.
+#
+# The panels are wired a column at a time, starting at the bottom left, so LED n of a plain panel is at x = n // height,
+# y = n % height. Serpentine panels run up the even columns and back down the odd ones. Several panels may be tiled side
+# by side, as a panel_group does, each continuing the strip where the last left off. The image drawn can be rotated and
+# mirrored to suit the way the panels are mounted.
+#
+# All of the arithmetic is done once, when the geometry is created, building a table of strip positions in row order
+# (2 bytes per LED). Drawing then costs a single lookup per LED. Plain Python only, so it can be checked on the host as well.
+
+class panel_geometry:
+    def __init__(self, width, height, panels=1, serpentine=False, rotation=0, mirror_x=False, mirror_y=False):
+        """ The mapping for one panel, or several tiled side by side
+
+        Args:
+            width (int):                    Number of columns of LEDs in each panel
+            height (int):                   Number of LEDs in each column
+            panels (int, optional):         Number of panels side by side. Defaults to 1.
+            serpentine (bool, optional):    The odd columns run from top to bottom. Defaults to False.
+            rotation (int, optional):       Rotate the image clockwise by 0, 90, 180 or 270 degrees. Defaults to 0.
+            mirror_x (bool, optional):      Flip the image left to right (before rotating it). Defaults to False.
+            mirror_y (bool, optional):      Flip the image top to bottom (before rotating it). Defaults to False.
+
+        Raises:
+            ValueError: Any invalid parameters are reported as exceptions
+        """
+        if rotation not in (0, 90, 180, 270):
+            raise ValueError("Panels can only be rotated by 0, 90, 180 or 270 degrees")
+
+        physical_width = width * panels
+        if rotation in (90, 270):
+            self.width, self.height = height, physical_width
+        else:
+            self.width, self.height = physical_width, height
+        self.leds = physical_width * height
+
+        # Strip positions in row order (y * width + x)
+        self._rows = array.array("H", [0 for _ in range(self.leds)])
+        for y in range(self.height):
+            for x in range(self.width):
+                self._rows[y * self.width + x] = self._led(x, y, width, height, serpentine, rotation, mirror_x, mirror_y)
+
+    def _led(self, x, y, width, height, serpentine, rotation, mirror_x, mirror_y):
+        # The strip position of a point in the image, working out where it lands on the panels
+        if mirror_x:
+            x = self.width - 1 - x
+        if mirror_y:
+            y = self.height - 1 - y
+
+        if rotation == 90:
+            x, y = y, self.width - 1 - x
+        elif rotation == 180:
+            x, y = self.width - 1 - x, self.height - 1 - y
+        elif rotation == 270:
+            x, y = self.height - 1 - y, x
+
+        panel, column = divmod(x, width)
+        if serpentine and column % 2:
+            y = height - 1 - y
+        return (panel * width + column) * height + y
+
+    def index(self, x, y):
+        """ The strip position of the LED at x, y - 0, 0 is the bottom left of the image """
+        return self._rows[y * self.width + x]
+
+    def row(self, y):
+        """ The strip positions of a row of LEDs, from left to right """
+        return memoryview(self._rows)[y * self.width : (y + 1) * self.width]
+
+    def column(self, x):
+        """ The strip positions of a column of LEDs, from bottom to top - stepping down the row table, as only the one
+        table is kept """
+        rows, width = self._rows, self.width
+        return (rows[y * width + x] for y in range(self.height))
+
+    @property
+    def table(self):
+        """ The strip positions of every LED in row order, for compiled code to look up """
+        return self._rows
+
+    def __str__(self):
+        return f"panel_geometry {self.width}x{self.height}"
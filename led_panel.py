@@ -1,28 +1,468 @@
 import array
+import framebuf
 import rp2
 
-from time     import sleep_ms
-from random   import randint
+from time     import ticks_us, ticks_diff, ticks_add
+from prng     import randint, default_state
 from machine  import Pin
+from uctypes  import addressof
 from neopixel import ws2812
+
+from geometry import panel_geometry
+
+import dma
+import pio
+import resources
+
+LATCH_US = 300 # Time the data line must be held low after the last bit for the LEDs to latch a frame
+BIT_US   = 1.25 # Time to send each bit to the LEDs at 800kHz
+FADE_TABLES = 4 # Fade tables kept for recently used fade values, so moving the fader doesn't rebuild them every frame
+FIRE_BLOCK  = 64 # LEDs the firelight brightens at a time
+UNSHOWN     = 0x01000000 # Never a valid LED colour - marks a firelight block whose colour isn't in the strip yet
+SPARK_ROWS  = 7  # Sparks are added to the bottom few LEDs of each column of the heat fire
+
+# Palette entries used by the effects in indexed mode
+# Palette entries used by the built in effects in indexed mode - see led_panel.set_palette()
+OFF_INDEX    = 0 # Black, for the beacon's unlit columns
+COLOUR_INDEX = 1 # The colour of the solid, strobe and beacon effects
+FIRE_INDEX   = 2 # The first of the firelight's blocks, one entry each
+
+def fade_reference(strip, count, fade):
+    """ Fade the first count LEDs of the strip towards black - red slowest, blue fastest. The plain Python version of
+    _fade(), kept to check it against. """
+    fade_r = 224 * fade # How quickly the redness fades
+    fade_g = 192 * fade # How quickly the greenness fades
+    fade_b = 128 * fade # How quickly the blueness fades
+
+    for led in range(count):
+        # Read the current colour
+        R = (strip[led] >>  8) & 0xff
+        G = (strip[led] >>  0) & 0xff
+        B = (strip[led] >> 16) & 0xff
+
+        # Fade it a little bit
+        R = (R * fade_r) >> 16
+        G = (G * fade_g) >> 16
+        B = (B * fade_b) >> 16
+
+        # Write the colour back to the strip
+        strip[led] = (G & 0xff) + ((R & 0xff) << 8) + ((B & 0xff) << 16)
+
+@micropython.viper                                                      # type: ignore
+def _fade(strip: ptr32, count: int, fade: int):                         # type: ignore
+    # Exactly as fade_reference(), but compiled - each LED is 0x00BBRRGG, and every product fits in 24 bits
+    fade_r = 224 * fade
+    fade_g = 192 * fade
+    fade_b = 128 * fade
+    for led in range(count):
+        value = strip[led]
+        R = (((value >>  8) & 0xff) * fade_r) >> 16
+        G = (((value      ) & 0xff) * fade_g) >> 16
+        B = (((value >> 16) & 0xff) * fade_b) >> 16
+        strip[led] = G | (R << 8) | (B << 16)
+
+def heat_palette(brightness, red, green, blue, palette=None):
+    """ The LED colour for each heat level of the heat fire, as FastLED's HeatColor() - black, through red and yellow to
+    white - scaled by the red, green and blue levels and the overall brightness """
+    if palette is None:
+        palette = array.array("I", [0 for _ in range(256)])
+    for heat in range(256):
+        t192 = (heat * 192) >> 8                  # Scale the heat down to 0...191
+        ramp = (t192 & 0x3f) << 2                 # How far through its third of the range it is, 0...252
+        if t192 & 0x80:
+            R, G, B = 255, 255, ramp              # Hottest third - yellow to white
+        elif t192 & 0x40:
+            R, G, B = 255, ramp, 0                # Middle third - red to yellow
+        else:
+            R, G, B = ramp, 0, 0                  # Coolest third - black to red
+
+        R = (R * red   * brightness) // 65025  # Divided by 255 * 255, so full colour at full brightness is unscaled
+        G = (G * green * brightness) // 65025
+        B = (B * blue  * brightness) // 65025
+        palette[heat] = (G & 0xff) + ((R & 0xff) << 8) + ((B & 0xff) << 16)
+    return palette
+
+@micropython.viper                                                      # type: ignore
+def _fire2012(heat: ptr8, state: ptr32, params: ptr32):                 # type: ignore
+    # One step of Mark Kriegsman's Fire2012 heat simulation, for each column of the heat map in turn (LED 0 of each
+    # column at the bottom). params holds the width, height, maximum cooling, sparking chance and spark rows. The
+    # random numbers come from inlining the prng.py generator, using the state array given.
+    width    = params[0]
+    height   = params[1]
+    cooling  = params[2]
+    sparking = params[3]
+    rows     = params[4]
+    x        = state[0]
+    for column in range(width):
+        base = column * height
+
+        # Cool every cell down a little
+        for y in range(height):
+            x ^= x << 13
+            x ^= (x >> 17) & 0x7fff
+            x ^= x << 5
+            cool = (((x >> 8) & 0xff) * cooling) >> 8
+            h    = heat[base + y]
+            if h > cool:
+                heat[base + y] = h - cool
+            else:
+                heat[base + y] = 0
+
+        # Heat drifts up and diffuses a little - dividing by three with a multiply and shift, exact up to 765
+        y = height - 1
+        while y >= 2:
+            heat[base + y] = ((heat[base + y - 1] + 2 * heat[base + y - 2]) * 683) >> 11
+            y -= 1
+
+        # Randomly ignite new sparks near the bottom
+        x ^= x << 13
+        x ^= (x >> 17) & 0x7fff
+        x ^= x << 5
+        if ((x >> 8) & 0xff) < sparking:
+            y = base + ((((x >> 16) & 0xff) * rows) >> 8)
+            h = heat[y] + 160 + ((((x >> 24) & 0xff) * 96) >> 8)
+            if h > 255:
+                h = 255
+            heat[y] = h
+    state[0] = x
+
+@micropython.viper                                                      # type: ignore
+def _expand(indices: ptr8, palette: ptr32, strip: ptr32, count: int):   # type: ignore
+    # Set each LED to the palette colour its byte selects
+    for led in range(count):
+        strip[led] = palette[indices[led]]
+
+@micropython.viper                                                      # type: ignore
+def _pack(strip: ptr32, frame: ptr8, count: int):                       # type: ignore
+    # Pack each 0x00BBRRGG word into three bytes, G R B, in the order they are sent to the LEDs
+    out = 0
+    for led in range(count):
+        value          = strip[led]
+        frame[out    ] = value
+        frame[out + 1] = value >> 8
+        frame[out + 2] = value >> 16
+        out           += 3
+
+@micropython.viper                                                      # type: ignore
+def _expand_packed(indices: ptr8, palette: ptr32, frame: ptr8, count: int):  # type: ignore
+    # As _expand(), but into a packed frame
+    out = 0
+    for led in range(count):
+        value          = palette[indices[led]]
+        frame[out    ] = value
+        frame[out + 1] = value >> 8
+        frame[out + 2] = value >> 16
+        out           += 3
+
+@micropython.viper                                                      # type: ignore
+def _apply_lut(source: ptr32, dest: ptr32, count: int, lut: ptr8):     # type: ignore
+    # Copy 0x00BBRRGG LEDs (or palette entries) passing each component through the output table
+    for led in range(count):
+        value     = source[led]
+        dest[led] = lut[value & 0xff] | (lut[(value >> 8) & 0xff] << 8) | (lut[(value >> 16) & 0xff] << 16)
+
+@micropython.viper                                                      # type: ignore
+def _pack_lut(strip: ptr32, frame: ptr8, count: int, lut: ptr8):        # type: ignore
+    # As _pack(), passing each component through the output table
+    out = 0
+    for led in range(count):
+        value          = strip[led]
+        frame[out    ] = lut[value & 0xff]
+        frame[out + 1] = lut[(value >> 8) & 0xff]
+        frame[out + 2] = lut[(value >> 16) & 0xff]
+        out           += 3
+
+@micropython.viper                                                      # type: ignore
+def _blend(strips: ptr32, dest: ptr32, count: int, mix: int):           # type: ignore
+    # Mix each LED of the outgoing strip (strips[0]) with the incoming one (strips[1]), mix/256 of the way to the
+    # incoming. Green and blue are a byte apart, so they are blended together in one word and red on its own - two
+    # multiplies per strip rather than three. The sums may reach the top bit, but the masks clear the sign it shifts in.
+    outgoing = ptr32(strips[0])                                         # type: ignore
+    incoming = ptr32(strips[1])                                         # type: ignore
+    keep     = 256 - mix
+    for led in range(count):
+        a  = outgoing[led]
+        b  = incoming[led]
+        GB = (((a & 0x00ff00ff) * keep + (b & 0x00ff00ff) * mix) >> 8) & 0x00ff00ff
+        R  = (((a & 0x0000ff00) * keep + (b & 0x0000ff00) * mix) >> 8) & 0x0000ff00
+        dest[led] = GB | R
+
+@micropython.viper                                                      # type: ignore
+def _blend_packed(strips: ptr32, frame: ptr8, count: int, mix: int):    # type: ignore
+    # As _blend(), but packing each blended LED straight into a packed frame
+    outgoing = ptr32(strips[0])                                         # type: ignore
+    incoming = ptr32(strips[1])                                         # type: ignore
+    keep     = 256 - mix
+    out      = 0
+    for led in range(count):
+        a  = outgoing[led]
+        b  = incoming[led]
+        GB = ((a & 0x00ff00ff) * keep + (b & 0x00ff00ff) * mix) >> 8
+        R  = ((a & 0x0000ff00) * keep + (b & 0x0000ff00) * mix) >> 16
+        frame[out    ] = GB
+        frame[out + 1] = R
+        frame[out + 2] = GB >> 16
+        out           += 3
+
+@micropython.viper                                                      # type: ignore
+def _lut_bytes(frame: ptr8, count: int, lut: ptr8):                     # type: ignore
+    # Pass each byte of a packed frame through the output table, in place
+    for n in range(count):
+        frame[n] = lut[frame[n]]
+
+def output_table(brightness, gamma=None, table=None):
+    """ The table applied to every colour component on its way to the LEDs - gamma correction, if a gamma is given,
+    then scaling by the overall brightness """
+    if table is None:
+        table = bytearray(256)
+    for level in range(256):
+        scaled = level / 255
+        if gamma is not None:
+            scaled = scaled ** gamma
+        table[level] = int(scaled * brightness + 0.5)
+    return table
+
+@micropython.viper                                                      # type: ignore
+def get_packed(frame: ptr8, led: int) -> int:                           # type: ignore
+    """ The colour of an LED in a packed frame, as a 0x00BBRRGG word """
+    at = led * 3
+    return frame[at] | (frame[at + 1] << 8) | (frame[at + 2] << 16)
+
+@micropython.viper                                                      # type: ignore
+def set_packed(frame: ptr8, led: int, colour: int):                     # type: ignore
+    """ Set the colour of an LED in a packed frame from a 0x00BBRRGG word """
+    at = led * 3
+    frame[at    ] = colour
+    frame[at + 1] = colour >> 8
+    frame[at + 2] = colour >> 16
+
+def scale_colour(brightness, red, green, blue):
+    """ The 0x00BBRRGG LED colour for red, green and blue levels (0...255) scaled by an overall brightness (0...255) """
+    R = int(red   * brightness/255)
+    G = int(green * brightness/255)
+    B = int(blue  * brightness/255)
+    return (G & 0xff) + ((R & 0xff) << 8) + ((B & 0xff) << 16)
+
+def rgb565(red, green, blue):
+    """ The RGB565 colour to draw on a panel's canvas with """
+    return ((red & 0xf8) << 8) | ((green & 0xfc) << 3) | (blue >> 3)
+
+@micropython.viper                                                      # type: ignore
+def _from_rgb565(canvas: ptr16, leds: ptr16, strip: ptr32, count: int):  # type: ignore
+    # Convert each RGB565 canvas pixel to a 0x00BBRRGG LED, at the strip position given for it by leds. The top bits of
+    # each component are repeated into the bottom ones, so that full scale stays full scale.
+    for pixel in range(count):
+        colour = canvas[pixel]
+        R = (colour >> 11) & 0x1f
+        G = (colour >>  5) & 0x3f
+        B = (colour      ) & 0x1f
+        strip[leds[pixel]] = ((G << 2) | (G >> 4)) | (((R << 3) | (R >> 2)) << 8) | (((B << 3) | (B >> 2)) << 16)
+
+@micropython.viper                                                      # type: ignore
+def _from_gs8(canvas: ptr8, leds: ptr16, indices: ptr8, count: int):    # type: ignore
+    # Copy each GS8 canvas pixel - a palette index - to the strip position given for it by leds
+    for pixel in range(count):
+        indices[leds[pixel]] = canvas[pixel]
+
+def fade_table(fade, table=None):
+    """ Build the lookup table used by _fade_lut() - the faded value of each possible red, green and blue level, in
+    that order, so the same fade as fade_reference() becomes three lookups per LED """
+    if table is None:
+        table = bytearray(768)
+    for level in range(256):
+        table[level      ] = (level * 224 * fade) >> 16
+        table[level + 256] = (level * 192 * fade) >> 16
+        table[level + 512] = (level * 128 * fade) >> 16
+    return table
+
+@micropython.viper                                                      # type: ignore
+def _fade_lut(strip: ptr32, count: int, table: ptr8):                   # type: ignore
+    # Fade each LED through a table made by fade_table()
+    for led in range(count):
+        value = strip[led]
+        R = table[((value >>  8) & 0xff)      ]
+        G = table[((value      ) & 0xff) + 256]
+        B = table[((value >> 16) & 0xff) + 512]
+        strip[led] = G | (R << 8) | (B << 16)
+
 class led_panel:
-    def __init__(self, pin, width, height, statemachine=0):
-        # Create the StateMachine with the ws2812 program
-        self._sm = rp2.StateMachine(0, ws2812, freq=8_000_000, sideset_base=Pin(pin))
-        self._sm.active(1)
+    def __init__(self, pin, width, height, statemachine=None, frames=2, indexed=False, packed=False, geometry=None):
+        """ Drive a panel of WS2812 LEDs
+
+        Effects render into the strip, and update() copies it into one of the output frames, which the DMA sends to the
+        LEDs while the next frame is rendered. With two output frames, update() waits if one frame is already queued
+        behind the one being sent. With three, the queued frame is replaced by the newer one and counted as dropped.
+
+        In indexed mode there is no strip. Effects instead write a byte per LED selecting one of 256 palette colours,
+        and animate by changing the palette where they can. update() expands the indices into the output frame.
+
+        Packed output frames hold three bytes per LED rather than a word, saving an LED's worth of bytes per frame, at the
+        cost of packing each frame with the CPU rather than copying it with the DMA.
+
+        Args:
+            pin (int):                      Pin the LED data line is connected to
+            width (int):                    Number of columns of LEDs
+            height (int):                   Number of LEDs in each column
+            statemachine (int, optional):   PIO statemachine to use. Defaults to None (any free statemachine).
+            frames (int, optional):         Number of output frames, 2 or 3. Defaults to 2.
+            indexed (bool, optional):       Render through a palette rather than into a strip. Defaults to False.
+            packed (bool, optional):        Pack the output frames as three bytes per LED. Defaults to False.
+            geometry (optional):            A panel_geometry mapping x, y to LEDs, for set_pixel(). Defaults to None
+                                            (columns wired bottom to top, not rotated, built when first used).
+
+        Raises:
+            ValueError: Any invalid parameters are reported as exceptions
+        """
+        if frames not in (2, 3):
+            raise ValueError("LED panels must have 2 or 3 output frames")
+        if indexed and FIRE_INDEX + (width * height) // FIRE_BLOCK > 256:
+            raise ValueError(f"Indexed LED panels can have at most {(256 - FIRE_INDEX) * FIRE_BLOCK} LEDs")
+        if geometry is not None and geometry.leds != width * height:
+            raise ValueError(f"The geometry is for {geometry.leds} LEDs, not {width * height}")
+        self._geometry = geometry       # The default is only built if it is used - see the geometry property
+
+        # Create the StateMachines with the ws2812 program - on any free statemachine unless told otherwise - and a DMA
+        # channel for each to feed the output frames into its FIFO, paced by its DREQ
+        self._packed     = packed
+        self._smnumbers  = []
+        self._sms        = []
+        self._outnumbers = []
+        self._outs       = []
+        self._dmanumber  = None
+        try:
+            self._claim_outputs(pin, statemachine)
+
+            # A DMA channel for filling and copying the LED array
+            self._dmanumber = resources.claim_dma(owner=f"led_panel on pin {pin}")
+        except:
+            # Release whatever was claimed before the failure, rather than losing it until the next reset
+            self.deinit()
+            raise
+        self._trigger_mask = sum(out.ChannelMask for out in self._outs)
+        self._dma          = dma.DmaChannel(self._dmanumber)
+
+        # Initialise the LED array to all off. Each word is 0x00BBRRGG, which the DMA byte swaps into the 0xGGRRBB00 the 
+        # ws2812 program expects (it shifts out the top 24 bits). Keeping the top byte clear keeps the values small ints.
+        self._width   = width
+        self._height  = height
+        self._strip   = None if indexed else array.array("I", [0 for _ in range(width * height)])
+
+        # In indexed mode, a palette index for each LED instead. _layout records which effect last set the indices up.
+        self._indices = bytearray(width * height) if indexed else None
+        self._palette = array.array("I", [0 for _ in range(256)])
+        self._layout  = None
+
+        # The output frames - a word per LED, or three bytes when packed. Each output sends an equal slice of each frame.
+        if packed:
+            self._frames = [bytearray(3 * width * height) for _ in range(frames)]
+        else:
+            self._frames = [array.array("I", [0 for _ in range(width * height)]) for _ in range(frames)]
+        size            = (3 if packed else 4) * width * height // len(self._outs)
+        transfer_size   = 1 if packed else 4
+        self._outputs   = [[out.Compile(addressof(frame) + n * size, pio.tx_fifo(self._smnumbers[n]), size // transfer_size)
+                            for n, out in enumerate(self._outs)] for frame in self._frames]
+        self._sending   = -1     # Output frame being sent, -1 if none
+        self._queued    = -1     # Output frame waiting to be sent, -1 if none
+        self._latched   = None   # When the frame being sent will have been sent and latched
+        self._frame_us  = int(24 * (width * height // len(self._outs)) * BIT_US) + LATCH_US
+
+        # Counters to show whether rendering or output is the bottleneck
+        self.frames_rendered = 0 # Calls to update()
+        self.frames_sent     = 0 # Frames actually sent to the LEDs
+        self.frames_dropped  = 0 # Frames replaced before they were sent (triple buffering only)
+        self.render_us       = 0 # Total time spent between calls to update(), ie rendering
+        self.wait_us         = 0 # Total time update() spent waiting for the output
+        self._last_update    = ticks_us()
 
-        # Initialise the LED array to all off
-        self._width  = width
-        self._height = height
-        self._strip  = array.array("I", [0 for _ in range(width * height)]) # GRB colour order
-        self._sm.put(self._strip, 8)
+        # Fade tables for the firelight, most recently used first. The tables are reused rather than reallocated.
+        self._fade_tables = [[-1, bytearray(768)] for _ in range(FADE_TABLES)]
+
+        # The firelight only ever sets whole blocks to one colour, and fading a uniform block leaves it uniform, so it
+        # keeps one colour per block. A block is valid while every LED in it is that colour - until another effect
+        # draws over it - and its colour is only filled into the strip when it differs from the one already shown.
+        blocks             = (width * height) // FIRE_BLOCK
+        self._blocks       = array.array("I", [0 for _ in range(blocks)])
+        self._block_shown  = array.array("I", [UNSHOWN for _ in range(blocks)])
+        self._block_valid  = bytearray(blocks)
+        self._valid_blocks = 0
+        if indexed:
+            # Each block has its own palette entry, so the firelight never touches the indices once they are set up
+            self._blocks   = memoryview(self._palette)[FIRE_INDEX:FIRE_INDEX + blocks]
+
+        # The heat fire keeps a heat level for each LED, turned into colours through the palette which is only rebuilt
+        # when the colour or brightness changes. In indexed mode the heat levels are the indices.
+        self._heat         = self._indices if indexed else bytearray(width * height)
+        self._heat_params  = array.array("i", [width, height, 0, 0, min(SPARK_ROWS, height)])
+        self._palette_key  = None
 
         # Initialise a counter for the beacon and strobe functions
         self._count = 0
 
+        # The canvas is only created if it is used
+        self._canvas = None
+
+        # The overall brightness and gamma correction applied on the way to the LEDs, so effects can render at full scale.
+        # At full brightness without gamma correction there is no table and the strip is copied by DMA as it is.
+        self._brightness     = 255
+        self._gamma          = None
+        self._output_table   = None
+        self._table_buffer   = bytearray(256)
+        self._output_palette = array.array("I", [0 for _ in range(256)]) if indexed else None
+
+        # A second strip for crossfading from one effect to another, only created if it is used. While _mix is 0...255
+        # update() blends the outgoing effect's strip with the incoming one's, _mix/256 of the way to the incoming.
+        self._outgoing       = None
+        self._outgoing_count = 0     # The outgoing effect's beacon and strobe counter
+        self._blend_strips   = array.array("I", [0, 0])
+        self._mix            = -1
+
+        self.update()
+
+    def _claim_outputs(self, pin, statemachine):
+        # A panel has a single output
+        self._claim_output(pin, statemachine)
+
+    def _claim_output(self, pin, statemachine):
+        # A statemachine running the ws2812 program, fed by a DMA channel either a word per LED, byte swapped, or a byte
+        # at a time from packed frames. Each byte is written to the FIFO on its own - the bus replicates it across the
+        # whole word - so for packed frames the statemachine pulls again after the top eight bits rather than 24. The
+        # threshold is statemachine configuration, so both share the one copy of the program in instruction memory.
+        # Each claim is recorded as soon as it is made, so that deinit() can release it if a later one fails
+        smnumber = resources.claim_statemachine(statemachine, ws2812, owner=f"led_panel on pin {pin}")
+        self._smnumbers.append(smnumber)
+        sm       = rp2.StateMachine(smnumber, ws2812, freq=8_000_000, sideset_base=Pin(pin),
+                                    pull_thresh=8 if self._packed else 24)
+        sm.active(1)
+        self._sms.append(sm)
+
+        outnumber = resources.claim_dma(owner=f"led_panel on pin {pin} output")
+        self._outnumbers.append(outnumber)
+        out       = dma.DmaChannel(outnumber)
+        if self._packed:
+            out.SetByteTransfer()
+        else:
+            out.SetWordTransfer()
+            out.SetByteSwap()
+        out.NoWriteIncr()
+        out.SetTREQ(pio.tx_dreq(smnumber))
+        self._outs.append(out)
+
+    def deinit(self):
+        """ Release the statemachines and DMA channels - the LEDs are left showing whatever was last sent """
+        if self._sms is None:
+            return
+        for out in self._outs:
+            out.Abort()
+        for smnumber in self._smnumbers:
+            resources.release_statemachine(smnumber)
+        for outnumber in self._outnumbers:
+            resources.release_dma(outnumber)
+        if self._dmanumber is not None:
+            resources.release_dma(self._dmanumber)
+        self._sms = None
+
     def __del__(self):
-        # TODO - tidy up the state machine
-        pass
+        self.deinit()
 
     def __repr__(self):
         # TODO - encode the class state - including which PIO
@@ -34,52 +474,211 @@ class led_panel:
 
     def firelight(self, brightness, red, green, blue, speed, fade):
         """ Create a fire-like effect on an LED panel """
-        fade_r         = 224 * fade # How quickly the redness fades
-        fade_g         = 192 * fade # How quickly the greenness fades
-        fade_b         = 128 * fade # How quickly the blueness fades
-        leds_per_block = 64
-        blocks         = (self._width * self._height) // leds_per_block
-
-        strip = self._strip
-
-        # First fade everything out slightly
-        for led in range(len(strip)):
-            # Read the current colour
-            R = (strip[led] >>  8) & 0xff
-            G = (strip[led] >> 16) & 0xff
-            B = (strip[led] >>  0) & 0xff
-            
-            # Fade it a little bit
-            R = (R * fade_r) >> 16 
-            G = (G * fade_g) >> 16
-            B = (B * fade_b) >> 16
+        leds_per_block = FIRE_BLOCK
+        blocks         = len(self._blocks)
+
+        strip  = self._strip
+        colour = self._blocks
+        valid  = self._block_valid
+        table  = self._fade_table(fade)
 
-            # Write the colour back to the strip
-            strip[led] = (B & 0xff) + ((R & 0xff) << 8) + ((G & 0xff) << 16)
+        if strip is None and self._set_layout("firelight"):
+            # Indexed - point each block's LEDs at its palette entry, starting from the colour of its first LED
+            indices = self._indices
+            for block in range(blocks):
+                colour[block] = self._palette[indices[block * leds_per_block]]
+                self._dma.Fill(addressof(indices) + block * leds_per_block, FIRE_INDEX + block, leds_per_block, size=dma.SIZE_BYTE)
+                valid[block] = 1
+            for led in range(blocks * leds_per_block, len(indices)):
+                indices[led] = OFF_INDEX
+            self._palette[OFF_INDEX] = 0
+            self._valid_blocks       = blocks
+
+        # First fade everything out slightly - the blocks' colours, plus any LEDs which aren't part of a valid block
+        _fade_lut(colour, blocks, table)
+        if strip is not None and self._valid_blocks < blocks:
+            address = addressof(strip)
+            for block in range(blocks):
+                if not valid[block]:
+                    _fade_lut(address + 4 * block * leds_per_block, leds_per_block, table)
+        if strip is not None:
+            _fade_lut(addressof(strip) + 4 * blocks * leds_per_block, len(strip) - blocks * leds_per_block, table)
 
         # Occasionally brighten some blocks up
         if (randint(0,255) <= speed):
 
             # Only brighten about three-quarters of the blocks each time
-            for block in range(blocks * 3 // 4):
+            for _ in range(blocks * 3 // 4):
 
                 # Pick a block at random
-                start_led = randint(0,blocks-1) * leds_per_block
-                end_led   = start_led + leds_per_block
+                block = randint(0,blocks-1)
 
                 # Pick a random intensity and colour for each block
                 R = randint(red//8,               red)              # Must be at least half of Red
                 G = randint(min(R//16, green//4), min(R//8, green)) # Can't be more than half of R
                 B = randint(min(G//16, blue//4),  min(G//8, blue))  # Can't be more than an eighth of G
 
-                # Apply the master brightness factor
-                R = (R * brightness) >> 8
-                G = (G * brightness) >> 8
-                B = (B * brightness) >> 8
+                # Apply the master brightness factor - divided by 255, so full brightness leaves the colour as it is
+                R = (R * brightness) // 255
+                G = (G * brightness) // 255
+                B = (B * brightness) // 255
+
+                colour[block] = (G & 0xff) + ((R & 0xff) << 8) + ((B & 0xff) << 16)
+                if not valid[block]:
+                    valid[block]             = 1
+                    self._block_shown[block] = UNSHOWN
+                    self._valid_blocks      += 1
+
+        # Fill the blocks whose colour has changed into the strip - in indexed mode the palette entries are all it takes
+        if strip is None:
+            return
+        shown   = self._block_shown
+        address = addressof(strip)
+        for block in range(blocks):
+            if valid[block] and shown[block] != colour[block]:
+                self._dma.Fill(address + 4 * block * leds_per_block, colour[block], leds_per_block)
+                shown[block] = colour[block]
+
+    def heatfire(self, brightness, red, green, blue, sparking, cooling):
+        """ Flames rising up each column of the panel, from a Fire2012 heat simulation
+
+        Args:
+            brightness (int):   An overall brightness in the range 0...255
+            red (int):          The amount of red in the range 0...255
+            green (int):        The amount of green (yellowness of the flames) in the range 0...255
+            blue (int):         The amount of blue (whiteness of the hottest flames) in the range 0...255
+            sparking (int):     Chance of a new spark in each column each frame, 0...255
+            cooling (int):      How quickly the flames cool, and so how high they reach, 0...255
+        """
+        self._set_layout("heatfire")
+        key = (brightness, red, green, blue)
+        if key != self._palette_key:
+            heat_palette(brightness, red, green, blue, self._palette)
+            self._palette_key = key
+
+        params    = self._heat_params
+        params[2] = (cooling * 10) // self._height + 2
+        params[3] = sparking
+        _fire2012(self._heat, default_state, params)
+        if self._strip is not None:
+            _expand(self._heat, self._palette, self._strip, len(self._strip))
+        self._invalidate_blocks()
+
+    @property
+    def geometry(self):
+        """ The panel_geometry mapping x, y to LEDs. Its table takes 2 bytes per LED, so unless one was given it isn't
+        built until something draws by position. """
+        if self._geometry is None:
+            self._geometry = self._default_geometry()
+        return self._geometry
+
+    def _default_geometry(self):
+        # A single panel, columns wired bottom to top
+        return panel_geometry(self._width, self._height)
+
+    def set_pixel(self, x, y, colour):
+        """ Set the LED at x, y (0, 0 is the bottom left) to a 0x00BBRRGG colour, or a palette index in indexed mode """
+        if self._strip is not None:
+            self._strip[self.geometry.index(x, y)] = colour
+            if self._valid_blocks:
+                self._invalidate_blocks()
+        else:
+            self._set_layout("pixels")
+            self._indices[self.geometry.index(x, y)] = colour
+
+    def get_pixel(self, x, y):
+        """ The colour of the LED at x, y, or its palette index in indexed mode """
+        if self._strip is not None:
+            return self._strip[self.geometry.index(x, y)]
+        return self._indices[self.geometry.index(x, y)]
+
+    def set_palette(self, index, colour):
+        """ Set a palette entry (0...255) to a 0x00BBRRGG colour, giving the indices drawn by set_pixel() or on the GS8
+        canvas their colours in indexed mode
+
+        The built in effects set up entries of their own as they draw: OFF_INDEX and COLOUR_INDEX for the solid colour,
+        strobe and beacon, OFF_INDEX and one entry per FIRE_BLOCK LEDs from FIRE_INDEX for the firelight, and every entry
+        for the heat fire. Entries above the firelight's are only touched by the heat fire.
+        """
+        self._palette[index] = colour
+        self._palette_key    = None     # The heat fire rebuilds its palette rather than assume it is still there
+
+    @property
+    def palette(self):
+        """ The 256 palette colours, as 0x00BBRRGG words - see set_palette() """
+        return self._palette
+
+    def canvas(self):
+        """ A framebuf.FrameBuffer to draw on, the size of the panel as its geometry describes it, 0, 0 at the top left.
+        It is RGB565 (see rgb565()), or GS8 palette indices in indexed mode. Nothing reaches the LEDs until show_canvas().
+        """
+        if self._canvas is None:
+            width  = self.geometry.width
+            height = self.geometry.height
+            table  = self.geometry.table
+
+            # The strip position of each canvas pixel - framebuf rows run top to bottom, the geometry's bottom to top
+            self._canvas_leds = array.array("H", [table[(height - 1 - y) * width + x] for y in range(height) for x in range(width)])
+            if self._strip is not None:
+                self._canvas_buffer = bytearray(2 * width * height)
+                self._canvas = framebuf.FrameBuffer(self._canvas_buffer, width, height, framebuf.RGB565)
+            else:
+                self._canvas_buffer = bytearray(width * height)
+                self._canvas = framebuf.FrameBuffer(self._canvas_buffer, width, height, framebuf.GS8)
+        return self._canvas
+
+    def show_canvas(self):
+        """ Copy the canvas onto the LEDs, ready for update() """
+        count = len(self._canvas_leds)
+        if self._strip is not None:
+            _from_rgb565(self._canvas_buffer, self._canvas_leds, self._strip, count)
+            self._invalidate_blocks()
+        else:
+            self._set_layout("canvas")
+            _from_gs8(self._canvas_buffer, self._canvas_leds, self._indices, count)
+
+    def _set_layout(self, layout):
+        # Record which effect is drawing, invalidating anything kept by the previous one. Returns True if it changed.
+        if layout == self._layout:
+            return False
+        self._layout      = layout
+        self._palette_key = None
+        self._invalidate_blocks()
+        return True
+
+    def fill_colour(self, value):
+        """ Set every LED to a 0x00BBRRGG colour - in indexed mode by changing a single palette entry """
+        if self._strip is not None:
+            self._dma.Fill(self._strip, value, len(self._strip))
+        else:
+            if self._set_layout("solid"):
+                self._dma.Fill(self._indices, COLOUR_INDEX, len(self._indices), size=dma.SIZE_BYTE)
+            self._palette[COLOUR_INDEX] = value
+        self._invalidate_blocks()
+
+    def _invalidate_blocks(self):
+        # Another effect has drawn on the strip, so the firelight's blocks no longer describe it
+        if self._valid_blocks:
+            valid = self._block_valid
+            for block in range(len(valid)):
+                valid[block] = 0
+            self._valid_blocks = 0
+
+    def _fade_table(self, fade):
+        # The fade table for this fade value - rebuilding the least recently used one if it isn't cached
+        tables = self._fade_tables
+        for n in range(len(tables)):
+            if tables[n][0] == fade:
+                break
+        else:
+            n = len(tables) - 1
+            tables[n][0] = fade
+            fade_table(fade, tables[n][1])
+
+        if n > 0:
+            tables.insert(0, tables.pop(n))
+        return tables[0][1]
 
-                for led in range(start_led, end_led):
-                    strip[led] = (B & 0xff) + ((R & 0xff) << 8) + ((G & 0xff) << 16)
-                    
     def fill(self, brightness, red, green, blue):
         """ Fill the entire LED panel with a single colour
 
@@ -90,23 +689,14 @@ class led_panel:
             g (int): The amount of green in the range 0...255
             b (int): The amount of blue in the range 0...255
         """
-        # Merge the overall brightness into the RGB values
-        R = int(red   * brightness/255)
-        G = int(green * brightness/255)
-        B = int(blue  * brightness/255)
-
-        # Set all of the LEDs to the calculated colour
-        value = (B & 0xff) + ((R & 0xff) << 8) + ((G & 0xff) << 16)
-        for led in range(len(self._strip)):
-            self._strip[led] = value
+        # Set all of the LEDs to the colour, with the overall brightness merged in
+        self.fill_colour(scale_colour(brightness, red, green, blue))
 
     def beacon(self, brightness, red, green, blue, speed, stripe):
-        # Merge the overall brightness into the RGB values
-        R = int(red   * brightness/255)
-        G = int(green * brightness/255)
-        B = int(blue  * brightness/255)
-        value = (B & 0xff) + ((R & 0xff) << 8) + ((G & 0xff) << 16)
+        self.beacon_colour(scale_colour(brightness, red, green, blue), speed, stripe)
 
+    def beacon_colour(self, value, speed, stripe):
+        """ A rotating beacon of a 0x00BBRRGG colour - speed sets the rotation speed and stripe its width (0...255) """
         # Increment the count
         self._count += speed * 4
             
@@ -117,35 +707,226 @@ class led_panel:
         # Convert the stripe width from 0-255 into 1-width
         stripe = ((stripe * self._width) // 255) +1
 
-        # Set all of the LEDs to the calculated colour
-        for led in range(len(self._strip)):
-            column = led // self._height
-
-            if (column + offset) % self._width < stripe:
-                self._strip[led] = value
-            else:
-                self._strip[led] = 0
+        # Set each column of LEDs to the calculated colour or off - the panel is wired a column at a time
+        height = self._height
+        if self._strip is not None:
+            strip = addressof(self._strip)
+            for column in range(self._width):
+                if (column + offset) % self._width < stripe:
+                    self._dma.Fill(strip + 4 * column * height, value, height)
+                else:
+                    self._dma.Fill(strip + 4 * column * height, 0, height)
+        else:
+            self._set_layout("beacon")
+            self._palette[OFF_INDEX]    = 0
+            self._palette[COLOUR_INDEX] = value
+            indices = addressof(self._indices)
+            for column in range(self._width):
+                index = COLOUR_INDEX if (column + offset) % self._width < stripe else OFF_INDEX
+                self._dma.Fill(indices + column * height, index, height, size=dma.SIZE_BYTE)
+        self._invalidate_blocks()
 
     def strobe(self, brightness, red, green, blue, speed1, speed2):
+        self.strobe_colour(scale_colour(brightness, red, green, blue), speed1, speed2)
 
+    def strobe_colour(self, value, speed1, speed2):
+        """ Flash a 0x00BBRRGG colour - speed1 sets the on time and speed2 the off time (0...255) """
         # Increment the count
         self._count += 1
         if self._count > (speed1 + speed2)/8:
             self._count = 0
 
-        if self._count < speed1/8:
-            # Merge the overall brightness into the RGB values
-            R = int(red   * brightness/255)
-            G = int(green * brightness/255)
-            B = int(blue  * brightness/255)
-            value = (B & 0xff) + ((R & 0xff) << 8) + ((G & 0xff) << 16)
+        # Set all of the LEDs to the colour, or off
+        self.fill_colour(value if self._count < speed1/8 else 0)
+
+    def set_output(self, brightness=255, gamma=None):
+        """ Set the overall brightness and gamma correction applied to every frame as it is sent - changing them only
+        costs rebuilding a table, whatever the effect
+
+        Args:
+            brightness (int, optional): The overall brightness in the range 0...255. Defaults to 255.
+            gamma (float, optional):    Gamma correction, such as 2.2, or None for none. Defaults to None.
+
+        Returns:
+            bool: True if either has changed, so the frame needs sending again to show it
+        """
+        if brightness == self._brightness and gamma == self._gamma:
+            return False
+        self._brightness = brightness
+        self._gamma      = gamma
+        if brightness == 255 and gamma is None:
+            self._output_table = None
         else:
-            value = 0
+            self._output_table = output_table(brightness, gamma, self._table_buffer)
+        return True
+
+    def start_crossfade(self):
+        """ Start crossfading from the effect on the strip to another. The strip is copied for the outgoing effect to
+        carry on drawing on - see swap_strips() - while the incoming effect draws on the strip, and set_crossfade() sets
+        how far the fade has got.
+
+        Returns:
+            bool: False, having done nothing, in indexed mode, which can only cut from one effect to the next
+        """
+        if self._strip is None:
+            return False
+        if self._outgoing is None:
+            self._outgoing = array.array("I", [0 for _ in range(len(self._strip))])
+        self._dma.Copy(self._outgoing, self._strip, len(self._strip))
+        self._outgoing_count = self._count
+        self._mix = 0
+        return True
+
+    def swap_strips(self):
+        """ Swap the strip with the outgoing effect's, so the outgoing effect can draw on it - and again to swap back.
+        Does nothing in indexed mode, or before start_crossfade() has made the second strip. """
+        if self._strip is None or self._outgoing is None:
+            return
+        self._strip, self._outgoing       = self._outgoing, self._strip
+        self._count, self._outgoing_count = self._outgoing_count, self._count
+        self._invalidate_blocks()
 
-        # Set all of the LEDs to the calculated colour
-        for led in range(len(self._strip)):
-            self._strip[led] = value
+    def set_crossfade(self, mix):
+        """ Set how far the crossfade has got, 0 (all the outgoing effect) to 256 (all the incoming effect) - which ends
+        it, so update() goes back to sending the strip as it is """
+        if self._strip is not None:
+            self._mix = mix if mix < 256 else -1
 
     def update(self):
-        self._sm.put(self._strip, 8)
-        sleep_ms(10) # Make sure there is some dead time before re-triggering the PIO
\ No newline at end of file
+        """ Queue the strip to be sent to the LEDs and return as soon as possible - the DMA sends it in the background
+        
+        The strip is copied into a free output frame, so rendering of the next frame can start straight away. If there
+        is no free frame (double buffering, with a frame already queued) wait for the frame being sent to finish.
+        """
+        start = ticks_us()
+        self.render_us += ticks_diff(start, self._last_update)
+        self.frames_rendered += 1
+
+        self.service()
+        if self._queued >= 0 and len(self._frames) == 2:
+            while self._queued >= 0:
+                self.service()
+            self.wait_us += ticks_diff(ticks_us(), start)
+
+        if self._queued >= 0:
+            frame = self._queued                          # Triple buffering - replace the frame which hasn't been sent
+            self.frames_dropped += 1
+        else:
+            frame = 0
+            while frame == self._sending:
+                frame += 1
+
+        # Copy, pack or expand the strip into the frame, through the output table if there is one
+        table   = self._output_table
+        palette = self._palette
+        strip   = self._strip
+        if strip is None and table is not None:
+            _apply_lut(palette, self._output_palette, 256, table)
+            palette = self._output_palette
+
+        if self._mix >= 0:
+            # Crossfading - blend the two strips straight into the frame, then apply the output table to it in place
+            strips    = self._blend_strips
+            strips[0] = addressof(self._outgoing)
+            strips[1] = addressof(strip)
+            if self._packed:
+                _blend_packed(strips, self._frames[frame], len(strip), self._mix)
+                if table is not None:
+                    _lut_bytes(self._frames[frame], 3 * len(strip), table)
+            else:
+                _blend(strips, self._frames[frame], len(strip), self._mix)
+                if table is not None:
+                    _apply_lut(self._frames[frame], self._frames[frame], len(strip), table)
+        elif self._packed:
+            if strip is None:
+                _expand_packed(self._indices, palette, self._frames[frame], len(self._indices))
+            elif table is None:
+                _pack(strip, self._frames[frame], len(strip))
+            else:
+                _pack_lut(strip, self._frames[frame], len(strip), table)
+        elif strip is None:
+            _expand(self._indices, palette, self._frames[frame], len(self._indices))
+        elif table is None:
+            self._dma.Copy(self._frames[frame], strip, len(strip))
+        else:
+            _apply_lut(strip, self._frames[frame], len(strip), table)
+        self._queued = frame
+        self.service()
+
+        self._last_update = ticks_us()
+
+    def service(self):
+        """ Start sending the queued frame if the previous one has finished and latched. Called by update(), but may
+        also be called while rendering a slow frame to reduce the latency of a queued one.
+        """
+        if self._sending >= 0:
+            for out in self._outs:
+                if out.IsBusy():
+                    return
+            for sm in self._sms:
+                if sm.tx_fifo():
+                    return
+            # The last word is still being shifted out, then the LEDs need the line held low to latch the frame. The
+            # deadline was set when the frame was started, so a frame which finished long ago isn't waited for again.
+            if ticks_diff(self._latched, ticks_us()) > 0:
+                return
+            self._sending = -1
+
+        if self._queued >= 0:
+            self._sending = self._queued
+            self._queued  = -1
+            transfers = self._outputs[self._sending]
+            if len(transfers) == 1:
+                self._outs[0].Arm(transfers[0])
+            else:
+                # Load every output, then start them together so the panels show the frame at the same moment
+                for transfer in transfers:
+                    dma.load(transfer)
+                dma.trigger(self._trigger_mask)
+            self._latched = ticks_add(ticks_us(), self._frame_us)
+            self.frames_sent += 1
+
+    def stats(self):
+        """ A summary of the output counters - a high wait time means output is the bottleneck, high render time and
+        no dropped frames mean rendering is """
+        frames = max(self.frames_rendered, 1)
+        return (f"{self.frames_rendered} rendered, {self.frames_sent} sent, {self.frames_dropped} dropped, "
+                f"render {self.render_us // frames}us/frame, waiting {self.wait_us // frames}us/frame")
+
+class panel_group(led_panel):
+    def __init__(self, pins, width, height, statemachines=None, frames=2, indexed=False, packed=False, geometry=None):
+        """ Several LED panels side by side, drawn on by the effects as one wide panel
+
+        Each panel has its own statemachine and output DMA channel, sending its own slice of the output frame - the panels
+        are wired a column at a time, so each panel's columns are consecutive. The outputs are all started at the same
+        moment, so a frame takes no longer to send to all of the panels than to one.
+
+        Args:
+            pins (list of int):                     Pins the panels' data lines are connected to, from left to right
+            width (int):                            Number of columns of LEDs in each panel
+            height (int):                           Number of LEDs in each column
+            statemachines (list of int, optional):  PIO statemachine for each panel. Defaults to None (any free ones).
+            frames (int, optional):                 Number of output frames, 2 or 3. Defaults to 2.
+            indexed (bool, optional):               Render through a palette rather than into a strip. Defaults to False.
+            packed (bool, optional):                Pack the output frames as three bytes per LED. Defaults to False.
+            geometry (optional):                    A panel_geometry for the whole group. Defaults to None (the panels
+                                                    side by side, columns wired bottom to top, not rotated).
+
+        Raises:
+            ValueError: Any invalid parameters are reported as exceptions
+        """
+        if statemachines is None:
+            statemachines = [None] * len(pins)
+        elif len(statemachines) != len(pins):
+            raise ValueError("Panel groups need a statemachine (or None) for each pin")
+
+        super().__init__(pins, width * len(pins), height, statemachines, frames, indexed, packed, geometry)
+
+    def _claim_outputs(self, pins, statemachines):
+        for pin, statemachine in zip(pins, statemachines):
+            self._claim_output(pin, statemachine)
+
+    def _default_geometry(self):
+        # The panels side by side, columns wired bottom to top
+        panels = len(self._outs)
+        return panel_geometry(self._width // panels, self._height, panels=panels)
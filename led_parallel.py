@@ -0,0 +1,143 @@
+import array
+import rp2
+
+from time      import ticks_us, ticks_diff, ticks_add
+from machine   import Pin
+from uctypes   import addressof
+from neopixel  import ws2812_parallel
+from led_panel import LATCH_US, BIT_US, get_packed, set_packed
+
+import dma
+import pio
+import resources
+
+@micropython.viper                                                      # type: ignore
+def _transpose(lanes: ptr32, frame: ptr8, count: int):                  # type: ignore
+    # Turn the nth byte of each of the eight lanes into eight bytes, one per bit from the most significant, each holding
+    # that bit of every lane (lane k in bit k). This is the 8x8 bit matrix transpose from Hacker's Delight (section
+    # 7-3), with lane 7 as the first row. The right shifts are signed, but the masks clear the bits they fill.
+    l0 = ptr8(lanes[0])                                                 # type: ignore
+    l1 = ptr8(lanes[1])                                                 # type: ignore
+    l2 = ptr8(lanes[2])                                                 # type: ignore
+    l3 = ptr8(lanes[3])                                                 # type: ignore
+    l4 = ptr8(lanes[4])                                                 # type: ignore
+    l5 = ptr8(lanes[5])                                                 # type: ignore
+    l6 = ptr8(lanes[6])                                                 # type: ignore
+    l7 = ptr8(lanes[7])                                                 # type: ignore
+    out = 0
+    for n in range(count):
+        x = (l7[n] << 24) | (l6[n] << 16) | (l5[n] << 8) | l4[n]
+        y = (l3[n] << 24) | (l2[n] << 16) | (l1[n] << 8) | l0[n]
+
+        t = (x ^ (x >> 7)) & 0x00AA00AA
+        x = x ^ t ^ (t << 7)
+        t = (y ^ (y >> 7)) & 0x00AA00AA
+        y = y ^ t ^ (t << 7)
+
+        t = (x ^ (x >> 14)) & 0x0000CCCC
+        x = x ^ t ^ (t << 14)
+        t = (y ^ (y >> 14)) & 0x0000CCCC
+        y = y ^ t ^ (t << 14)
+
+        t = (x & ~0x0F0F0F0F) | ((y >> 4) & 0x0F0F0F0F)
+        y = ((x << 4) & ~0x0F0F0F0F) | (y & 0x0F0F0F0F)
+        x = t
+
+        frame[out    ] = x >> 24
+        frame[out + 1] = x >> 16
+        frame[out + 2] = x >> 8
+        frame[out + 3] = x
+        frame[out + 4] = y >> 24
+        frame[out + 5] = y >> 16
+        frame[out + 6] = y >> 8
+        frame[out + 7] = y
+        out += 8
+
+class led_parallel:
+    def __init__(self, pin, lanes, leds, statemachine=None):
+        """ Drive up to eight strips of WS2812 LEDs at once, from a single state machine
+
+        Each strip (lane) has its own buffer of packed LEDs, three bytes each in G R B order - see led_panel.get_packed()
+        and set_packed(). update() transposes them into one output frame, which sends a bit to every strip at once, so
+        all of the strips take only as long to refresh as one of them. The transpose into one frame overlaps the
+        sending of the other.
+
+        Args:
+            pin (int):                      First of the consecutive pins the strips' data lines are connected to
+            lanes (int):                    Number of strips, 1...8
+            leds (int):                     Number of LEDs in each strip
+            statemachine (int, optional):   PIO statemachine to use. Defaults to None (any free statemachine).
+
+        Raises:
+            ValueError: Any invalid parameters are reported as exceptions
+        """
+        if lanes < 1 or lanes > 8:
+            raise ValueError("Parallel LED outputs must have 1...8 lanes")
+
+        owner           = f"led_parallel on pins {pin}-{pin + lanes - 1}"
+        program         = ws2812_parallel(lanes)
+        self._sm        = None
+        self._smnumber  = resources.claim_statemachine(statemachine, program, owner=owner)
+        try:
+            self._sm        = rp2.StateMachine(self._smnumber, program, freq=8_000_000, out_base=Pin(pin))
+            self._outnumber = resources.claim_dma(owner=owner)
+        except:
+            # Release the statemachine, rather than losing it (and its program space) until the next reset
+            resources.release_statemachine(self._smnumber)
+            self._sm = None
+            raise
+        self._sm.active(1)
+
+        # The strips' buffers, and a table of their addresses for the transpose - unused lanes read a blank strip
+        self.strips    = [bytearray(3 * leds) for _ in range(lanes)]
+        blank          = bytearray(3 * leds) if lanes < 8 else None
+        self._lanes    = array.array("I", [addressof(self.strips[lane] if lane < lanes else blank) for lane in range(8)])
+        self._blank    = blank
+        self._leds     = leds
+
+        # The DMA feeds a word (four bits for each lane) at a time into the FIFO, paced by its DREQ
+        self._out       = dma.DmaChannel(self._outnumber)
+        self._out.SetWordTransfer()
+        self._out.NoWriteIncr()
+        self._out.SetTREQ(pio.tx_dreq(self._smnumber))
+        self._frames    = [bytearray(24 * leds) for _ in range(2)]
+        self._outputs   = [self._out.Compile(frame, pio.tx_fifo(self._smnumber), len(frame) // 4) for frame in self._frames]
+        self._next      = 0
+        self._latched   = None  # When the frame being sent will have been sent and latched, None if nothing is sending
+        self._frame_us  = int(24 * leds * BIT_US) + LATCH_US
+
+    def deinit(self):
+        """ Release the statemachine and DMA channel - the LEDs are left showing whatever was last sent """
+        if self._sm is None:
+            return
+        self._out.Abort()
+        resources.release_statemachine(self._smnumber)
+        resources.release_dma(self._outnumber)
+        self._sm = None
+
+    def __del__(self):
+        self.deinit()
+
+    def get_led(self, lane, led):
+        """ The colour of an LED as a 0x00BBRRGG word, as used by led_panel """
+        return get_packed(self.strips[lane], led)
+
+    def set_led(self, lane, led, colour):
+        """ Set the colour of an LED from a 0x00BBRRGG word """
+        set_packed(self.strips[lane], led, colour)
+
+    def update(self):
+        """ Send the strips to the LEDs - transposing them while the previous frame is still being sent, then waiting
+        for it to finish and latch before starting the DMA """
+        frame = self._next
+        _transpose(self._lanes, self._frames[frame], 3 * self._leds)
+
+        if self._latched is not None:
+            while self._out.IsBusy() or self._sm.tx_fifo():
+                pass
+            while ticks_diff(self._latched, ticks_us()) > 0:
+                pass
+
+        self._out.Arm(self._outputs[frame])
+        self._latched = ticks_add(ticks_us(), self._frame_us)
+        self._next    = frame ^ 1
@@ -16,4 +16,27 @@ def ws2812():
     jmp("bitloop")          .side(1)    [T2 - 1]    
     label("do_zero")                                
     nop()                   .side(0)    [T2 - 1]    
-    wrap() 
\ No newline at end of file
+    wrap() 
+
+# Drives up to eight strips at once, on consecutive pins, from bit-transposed data: each byte holds one bit for every
+# strip (strip n in bit n), and each LED bit is sent to all of the strips together. All the lines go high, those sending
+# a one stay high while the others drop, then all go low. The programs differ only in the number of pins, so they are
+# built on demand and kept.
+_parallel = {}
+
+def ws2812_parallel(lanes):
+    """ The parallel WS2812 program for the given number of strips, 1...8 """
+    if lanes not in _parallel:
+        @rp2.asm_pio(out_init=(rp2.PIO.OUT_LOW,) * lanes, out_shiftdir=rp2.PIO.SHIFT_RIGHT, autopull=True, pull_thresh=32)
+        def program():
+            T1 = 2
+            T2 = 5
+            T3 = 3
+            wrap_target()
+            out(x, 8)                                   # Stalls here, with the lines low, when the data runs out
+            mov(pins, invert(null))     [T1 - 1]
+            mov(pins, x)                [T2 - 1]
+            mov(pins, null)             [T3 - 2]
+            wrap()
+        _parallel[lanes] = program
+    return _parallel[lanes]
@@ -0,0 +1,45 @@
+# Addresses and DMA request numbers for the PIO state machine FIFOs, derived from the rp2.StateMachine id (0-3 are the
+# state machines of PIO0, 4-7 those of PIO1). See sections 2.5.3.1 and 3.7 of the RP2040 datasheet.
+
+PIO0_BASE       = 0x50200000
+PIO1_BASE       = 0x50300000
+PIO_TXF0        = 0x010            # TX FIFOs, one word per state machine
+PIO_RXF0        = 0x020            # RX FIFOs, one word per state machine
+
+def _check(statemachine):
+    if statemachine < 0 or statemachine > 7:
+        raise ValueError("PIO state machines must be 0...7")
+
+def pio_base(statemachine):
+    """ The register base address of the PIO block containing the state machine """
+    _check(statemachine)
+    return PIO0_BASE if statemachine < 4 else PIO1_BASE
+
+def tx_fifo(statemachine):
+    """ The address to write to push data into the state machine's TX FIFO
+
+    A byte or halfword DMA write to this address is replicated across the whole word, so no lane offset is needed.
+    """
+    return pio_base(statemachine) + PIO_TXF0 + 4 * (statemachine % 4)
+
+def rx_fifo(statemachine, lane=0):
+    """ The address to read to pop data from the state machine's RX FIFO
+
+    Args:
+        statemachine (int):     rp2.StateMachine id, 0...7
+        lane (int, optional):   Byte offset within the FIFO word to read from. A program shifting right which pushes an
+                                8 bit value leaves it in the top byte, so a byte-sized DMA should use lane 3. Defaults to 0.
+    """
+    if lane < 0 or lane > 3:
+        raise ValueError("FIFO byte lanes must be 0...3")
+    return pio_base(statemachine) + PIO_RXF0 + 4 * (statemachine % 4) + lane
+
+def tx_dreq(statemachine):
+    """ The DMA TREQ_SEL value paced by the state machine's TX FIFO having space """
+    _check(statemachine)
+    return (statemachine // 4) * 8 + statemachine % 4
+
+def rx_dreq(statemachine):
+    """ The DMA TREQ_SEL value paced by the state machine's RX FIFO having data """
+    _check(statemachine)
+    return (statemachine // 4) * 8 + 4 + statemachine % 4
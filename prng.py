@@ -0,0 +1,78 @@
+import array
+
+from random import getrandbits                                          # type: ignore
+
+# A small, fast pseudo-random number generator for the LED effects.
+#
+# random.randint() is a general purpose function call which may allocate on every use. This is Marsaglia's xorshift32
+# generator, compiled with viper and keeping its state in a preallocated array, so drawing a number allocates nothing.
+# It is plenty random enough for flickering LEDs, but is no use for anything needing real randomness.
+#
+# Every generator state is a one word array made by new_state(). The module has a default state, used by randint(),
+# below() and fill(), which can be seeded to make an effect render exactly the same frames on every run.
+
+DEFAULT_SEED = 2463534242                   # Marsaglia's example seed - used in place of zero, which never changes
+MAX_RANGE    = 32768                        # Largest range below() can draw from
+
+def new_state(seed=None):
+    """ A generator state, seeded from the hardware random number generator unless a seed is given """
+    state = array.array("I", [0])
+    seed_state(state, getrandbits(32) if seed is None else seed)
+    return state
+
+def seed_state(state, seed):
+    state[0] = (seed & 0xffffffff) or DEFAULT_SEED
+
+@micropython.viper                                                      # type: ignore
+def _below(state: ptr32, n: int) -> int:                                # type: ignore
+    # Step the generator, then scale the top 16 bits into 0...n-1 with a multiply and shift rather than a divide. The
+    # arithmetic is kept signed (and the right shifts masked) so that everything stays within a 32 bit int.
+    x = state[0]
+    x ^= x << 13
+    x ^= (x >> 17) & 0x7fff
+    x ^= x << 5
+    state[0] = x
+    return (((x >> 16) & 0xffff) * n) >> 16
+
+@micropython.viper                                                      # type: ignore
+def _fill(state: ptr32, buffer: ptr8, length: int):                     # type: ignore
+    # Fill length bytes of the buffer, four bytes from each step of the generator
+    x   = state[0]
+    pos = 0
+    while pos < length:
+        x ^= x << 13
+        x ^= (x >> 17) & 0x7fff
+        x ^= x << 5
+        value = x
+        end   = pos + 4
+        if end > length:
+            end = length
+        while pos < end:
+            buffer[pos] = value & 0xff
+            value >>= 8
+            pos    += 1
+    state[0] = x
+
+default_state = new_state()
+
+def seed(value):
+    """ Seed the default generator, so that the same sequence of numbers follows """
+    seed_state(default_state, value)
+
+def below(n, state=default_state):
+    """ A random integer in the range 0...n-1, where n is at most MAX_RANGE """
+    return _below(state, n)
+
+def randint(a, b, state=default_state):
+    """ A random integer in the range a...b inclusive, as random.randint(). The range may be at most MAX_RANGE. """
+    return a + _below(state, b - a + 1)
+
+def fill(buffer, length=None, state=default_state):
+    """ Fill a buffer with random bytes
+
+    Args:
+        buffer:                 Any writable buffer, such as a bytearray or array
+        length (int, optional): The number of bytes to fill. Defaults to len(buffer), which is only the length in bytes
+                                for a bytearray - give the length for other arrays.
+    """
+    _fill(state, buffer, len(buffer) if length is None else length)
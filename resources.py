@@ -0,0 +1,181 @@
+import _thread                        # type: ignore
+import rp2                            # type: ignore
+
+# Registry of the RP2040 hardware resources which MicroPython does not track for us.
+#
+# Neither the DMA channels nor the PIO state machines can be interrogated to find out whether something else is already
+# using them, so every class in this project claims what it needs here and releases it again in deinit(). Claims may
+# either ask for a specific resource (raising an exception if it is already in use) or pass None to be given any free
+# one. The PIO instruction memory (32 instructions per PIO block) is tracked per program so that several state machines
+# running the same program only use its space once.
+#
+# The registry is protected by a lock as the LED effects run in a second thread and may create their outputs at the
+# same time as the DMX receiver is being set up.
+
+NUM_DMA_CHANNELS   = 12
+NUM_STATEMACHINES  = 8
+NUM_PIOS           = 2
+PIO_INSTRUCTIONS   = 32
+STATEMACHINES_PER_PIO = NUM_STATEMACHINES // NUM_PIOS
+
+_lock         = _thread.allocate_lock()
+_dma_owners   = [None] * NUM_DMA_CHANNELS
+_sm_owners    = [None] * NUM_STATEMACHINES
+_sm_programs  = [None] * NUM_STATEMACHINES
+_programs     = [{} for _ in range(NUM_PIOS)]    # Per PIO: id(program) -> [program, length, users]
+_sniffer      = [None]                           # The DMA block has a single sniffer (CRC/checksum unit)
+
+def program_length(program):
+    """ The number of PIO instructions used by a program created with rp2.asm_pio """
+    return len(program[0])
+
+def claim_dma(channel=None, owner=None):
+    """ Claim a DMA channel
+
+    Args:
+        channel (int, optional):    The channel required, or None for any free channel. Defaults to None.
+        owner (object, optional):   Description of the user, reported if someone else tries to claim the channel.
+
+    Raises:
+        ValueError:   The channel number is invalid
+        RuntimeError: The channel is already in use, or there are no free channels
+
+    Returns:
+        int: The channel number claimed
+    """
+    with _lock:
+        if channel is None:
+            for candidate in range(NUM_DMA_CHANNELS):
+                if _dma_owners[candidate] is None:
+                    channel = candidate
+                    break
+            else:
+                raise RuntimeError("No free DMA channels")
+        elif channel < 0 or channel >= NUM_DMA_CHANNELS:
+            raise ValueError(f"DMA channels must be 0...{NUM_DMA_CHANNELS - 1}")
+        elif _dma_owners[channel] is not None:
+            raise RuntimeError(f"DMA channel {channel} is already in use by {_dma_owners[channel]}")
+
+        _dma_owners[channel] = owner if owner is not None else True
+        return channel
+
+def release_dma(channel):
+    """ Release a DMA channel previously claimed with claim_dma() """
+    with _lock:
+        _dma_owners[channel] = None
+
+def claim_sniffer(owner=None):
+    """ Claim the DMA sniffer - there is only one, shared by all of the DMA channels
+
+    Raises:
+        RuntimeError: The sniffer is already in use
+    """
+    with _lock:
+        if _sniffer[0] is not None:
+            raise RuntimeError(f"The DMA sniffer is already in use by {_sniffer[0]}")
+        _sniffer[0] = owner if owner is not None else True
+
+def release_sniffer():
+    with _lock:
+        _sniffer[0] = None
+
+def claim_statemachine(statemachine=None, program=None, owner=None):
+    """ Claim a PIO state machine, and space in its PIO's instruction memory for the program it will run
+
+    Args:
+        statemachine (int, optional): The state machine required (0-3 on PIO0, 4-7 on PIO1), or None for any free state
+                                      machine whose PIO has room for the program. Defaults to None.
+        program (optional):           The rp2.asm_pio program which will be run. Defaults to None.
+        owner (object, optional):     Description of the user, reported if someone else tries to claim it.
+
+    Raises:
+        ValueError:   The state machine number is invalid
+        RuntimeError: The state machine is already in use, there is no room for the program, or nothing is free
+
+    Returns:
+        int: The state machine number claimed
+    """
+    with _lock:
+        if statemachine is None:
+            # Prefer a PIO which already has the program loaded, then one with room for it
+            best = None
+            for candidate in range(NUM_STATEMACHINES):
+                if _sm_owners[candidate] is not None:
+                    continue
+                needed = _instructions_needed(candidate // STATEMACHINES_PER_PIO, program)
+                if needed == 0:
+                    best = candidate
+                    break
+                if best is None and needed <= _free_instructions(candidate // STATEMACHINES_PER_PIO):
+                    best = candidate
+            if best is None:
+                raise RuntimeError("No free PIO state machines with room for the program")
+            statemachine = best
+        elif statemachine < 0 or statemachine >= NUM_STATEMACHINES:
+            raise ValueError(f"PIO state machines must be 0...{NUM_STATEMACHINES - 1}")
+        elif _sm_owners[statemachine] is not None:
+            raise RuntimeError(f"PIO state machine {statemachine} is already in use by {_sm_owners[statemachine]}")
+
+        if program is not None:
+            _claim_program(statemachine // STATEMACHINES_PER_PIO, program)
+
+        _sm_owners[statemachine]   = owner if owner is not None else True
+        _sm_programs[statemachine] = program
+        return statemachine
+
+def release_statemachine(statemachine):
+    """ Stop a state machine claimed with claim_statemachine(), and release it along with its program space """
+    with _lock:
+        rp2.StateMachine(statemachine).active(0)
+
+        program = _sm_programs[statemachine]
+        if program is not None:
+            _release_program(statemachine // STATEMACHINES_PER_PIO, program)
+
+        _sm_owners[statemachine]   = None
+        _sm_programs[statemachine] = None
+
+def free_instructions(pio):
+    """ The number of instructions still available in the given PIO block (0 or 1) """
+    with _lock:
+        return _free_instructions(pio)
+
+def _free_instructions(pio):
+    return PIO_INSTRUCTIONS - sum(entry[1] for entry in _programs[pio].values())
+
+def _instructions_needed(pio, program):
+    if program is None or id(program) in _programs[pio]:
+        return 0
+    return program_length(program)
+
+def _claim_program(pio, program):
+    entry = _programs[pio].get(id(program))
+    if entry is not None:
+        entry[2] += 1
+        return
+
+    length = program_length(program)
+    if length > _free_instructions(pio):
+        raise RuntimeError(f"PIO{pio} has only {_free_instructions(pio)} free instructions, {length} needed")
+    _programs[pio][id(program)] = [program, length, 1]
+
+def _release_program(pio, program):
+    entry = _programs[pio][id(program)]
+    entry[2] -= 1
+    if entry[2] == 0:
+        del _programs[pio][id(program)]
+        rp2.PIO(pio).remove_program(program)
+
+def status():
+    """ Print a summary of the resources in use """
+    with _lock:
+        for channel in range(NUM_DMA_CHANNELS):
+            if _dma_owners[channel] is not None:
+                print(f"DMA{channel:<2}  {_dma_owners[channel]}")
+        for statemachine in range(NUM_STATEMACHINES):
+            if _sm_owners[statemachine] is not None:
+                print(f"SM{statemachine:<3}  {_sm_owners[statemachine]}")
+        if _sniffer[0] is not None:
+            print(f"Sniffer {_sniffer[0]}")
+        for pio in range(NUM_PIOS):
+            print(f"PIO{pio}  {_free_instructions(pio)} instructions free")
@@ -1,5 +1,6 @@
-from dmx import DMX_RX
-from led_panel import led_panel
+from dmx import DMX_RX, DMX_TX
+from dmx_recorder import DMX_Recorder, DMX_Player
+from led_panel import led_panel, panel_group
 import _thread
 import gc
 
@@ -29,6 +30,559 @@ def dmx_test():
             print(f" Frames Rxd:{current_frame}")
             last_frame = current_frame
 
+def record_test(seconds=10, filename="show.dmx"):
+    # Record whatever is on the DMX input, then play it back on the DMX output
+    from time import ticks_ms, ticks_diff, ticks_us
+
+    dmx_in = DMX_RX(pin=28)
+    dmx_in.start()
+
+    recorder = DMX_Recorder(dmx_in, filename)
+    recorder.start()
+
+    worst = 0
+    start = ticks_ms()
+    while ticks_diff(ticks_ms(), start) < seconds * 1000:
+        t = ticks_us()
+        if recorder.poll():
+            worst = max(worst, ticks_diff(ticks_us(), t))
+    recorder.stop()
+    dmx_in.deinit()
+    print(f"{recorder}  Worst poll: {worst}us  Rate: {recorder.bytes_written / seconds:.0f} bytes/s")
+
+    dmx_out = DMX_TX(pin=3)
+    dmx_out.start(period=23)
+
+    player = DMX_Player(dmx_out, filename)
+    player.play()
+    player.stop()
+    dmx_out.deinit()
+    print(f"Played {player.frames_played} frames")
+
+def dma_rearm_test(repeats=1000):
+    # Compare the cost of restarting a small memory-to-memory DMA transfer: register by register, with the viper
+    # SetChannelData() (the original way), precompiled with dma.arm(), and with a single write to an alias trigger
+    # register. Each method must really copy the word, so dest is cleared before each one and checked afterwards.
+    from time    import ticks_us, ticks_diff
+    from uctypes import addressof
+    import array
+    import dma
+    import resources
+
+    channel = dma.DmaChannel(resources.claim_dma(owner="dma_rearm_test"))
+    source  = array.array("I", [0x12345678])
+    dest    = array.array("I", [0])
+    channel.SetWordTransfer()
+    channel.SetTREQ(dma.TREQ_UNPACED)
+    read    = addressof(source)
+    write   = addressof(dest)
+    results = []
+
+    def check(name, elapsed):
+        channel.WaitForCompletion()
+        results.append(f"{name} {elapsed/repeats:.1f}us {'OK' if dest[0] == 0x12345678 else 'FAILED'}")
+        dest[0] = 0
+
+    start = ticks_us()
+    for _ in range(repeats):
+        channel.SetReadAddress(read)
+        channel.SetWriteAddress(write)
+        channel.SetTransferCount(1)
+        channel.TriggerChannel()
+    check("separate registers", ticks_diff(ticks_us(), start))
+
+    start = ticks_us()
+    for _ in range(repeats):
+        channel.SetChannelData(read, write, 1, True)
+    check("SetChannelData", ticks_diff(ticks_us(), start))
+
+    transfer = channel.Compile(source, dest, 1)
+    arm = dma.arm
+    start = ticks_us()
+    for _ in range(repeats):
+        arm(transfer)
+    check("compiled", ticks_diff(ticks_us(), start))
+
+    # Copying into the same word every time, so write incrementing is turned off for the alias retrigger
+    channel.NoWriteIncr()
+    arm(channel.Compile(source, dest, 1))
+    channel.WaitForCompletion()
+    dest[0] = 0
+    retrigger = channel.RetriggerRead
+    start = ticks_us()
+    for _ in range(repeats):
+        retrigger(read)
+    check("alias retrigger", ticks_diff(ticks_us(), start))
+
+    resources.release_dma(channel.ChannelNumber)
+    print("Re-arm cost: " + "  ".join(results))
+
+def control_block_test():
+    # Gather three buffers into one with a DMA control block list, and check the register model agrees on the order
+    import array
+    from uctypes import addressof
+    import dma
+    import dma_model
+    import resources
+
+    loader  = dma.DmaChannel(resources.claim_dma(owner="control_block_test loader"))
+    worker  = dma.DmaChannel(resources.claim_dma(owner="control_block_test worker"))
+    worker.SetWordTransfer()
+    worker.SetTREQ(dma.TREQ_UNPACED)
+
+    segments = [array.array("I", [(n << 16) | word for word in range(length)]) for n, length in enumerate((4, 2, 8))]
+    gathered = array.array("I", [0] * 14)
+    blocks   = dma.DmaControlBlocks(loader, worker, len(segments))
+    offset   = 0
+    for segment in segments:
+        blocks.Add(segment, addressof(gathered) + 4 * offset, len(segment))
+        offset += len(segment)
+
+    blocks.Start()
+    blocks.WaitForCompletion()
+    expected = [word for segment in segments for word in segment]
+    print(f"Hardware: {'OK' if list(gathered) == expected else 'FAILED'}")
+
+    # Replay the same blocks through the model
+    model = dma_model.DmaModel()
+    table = blocks.Blocks()
+    model.load_words(addressof(blocks._blocks), table)
+    for segment in segments:
+        model.load_words(addressof(segment), segment)
+    model.channels[loader.ChannelNumber].update(read=addressof(blocks._blocks), write=worker.ChannelBase, count=4, ctrl=blocks._start[3])
+    model.write(dma_model.DMA_MULTI_TRIGGER, loader.ChannelMask)
+    model.run()
+    order = [entry[1] for entry in model.log if entry[0] == worker.ChannelNumber]
+    print(f"Model:    {'OK' if order == [addressof(segment) for segment in segments] else 'FAILED'}")
+
+    resources.release_dma(loader.ChannelNumber)
+    resources.release_dma(worker.ChannelNumber)
+
+def fill_test(repeats=20):
+    # Compare filling the whole panel from an interpreted loop with a DMA fill
+    from time import ticks_us, ticks_diff
+
+    panel = led_panel(pin=27, width=32, height=32)
+    strip = panel._strip
+
+    start = ticks_us()
+    for _ in range(repeats):
+        for led in range(len(strip)):
+            strip[led] = 0x00102030
+    loop = ticks_diff(ticks_us(), start)
+
+    start = ticks_us()
+    for _ in range(repeats):
+        panel._dma.Fill(strip, 0x00102030, len(strip))
+    fill = ticks_diff(ticks_us(), start)
+
+    panel.deinit()
+    print(f"Full panel fill ({len(strip)} LEDs): loop {loop/repeats:.0f}us  DMA {fill/repeats:.0f}us")
+
+def checksum_test():
+    # Check the DMA sniffer against the standard check values for "123456789"
+    import dma
+    import resources
+
+    channel = dma.DmaChannel(resources.claim_dma(owner="checksum_test"))
+    data    = bytearray(b"123456789")
+
+    crc32 = channel.Checksum(data, len(data), dma.SNIFF_CRC32)
+    crc16 = channel.Checksum(data, len(data), dma.SNIFF_CRC16) & 0xffff
+    total = channel.Checksum(data, len(data), dma.SNIFF_SUM)
+    resources.release_dma(channel.ChannelNumber)
+
+    print(f"CRC32 0x{crc32:08x} {'OK' if crc32 == 0xcbf43926 else 'FAILED'}")
+    print(f"CRC16 0x{crc16:04x} {'OK' if crc16 == 0x29b1 else 'FAILED'}")
+    print(f"Sum   {total} {'OK' if total == sum(data) else 'FAILED'}")
+
+def dma_timing_test(seconds=5):
+    # Time the DMA transfers of a DMX transmitter - each 513 byte frame should take ~23ms, inside a 25ms period
+    from time import sleep_ms
+
+    dmx_out = DMX_TX(pin=3)
+    timing  = dmx_out._dma.EnableTiming(budgetUs=25_000, elementUs=200)    # Allow for the break before the data
+    dmx_out.start(period=25)
+
+    for _ in range(seconds * 100):
+        timing.Poll()
+        sleep_ms(10)
+
+    dmx_out.deinit()
+    print(timing)
+
+def frame_rate_test(frames=100, buffers=2, indexed=False, packed=False):
+    # Frames per second of the firelight effect on a 32x32 panel, with the output running in the background
+    from time import ticks_ms, ticks_diff
+
+    panel = led_panel(pin=27, width=32, height=32, frames=buffers, indexed=indexed, packed=packed)
+    start = ticks_ms()
+    for _ in range(frames):
+        panel.firelight(brightness=255, red=255, green=64, blue=10, speed=128, fade=255)
+        panel.update()
+    elapsed = ticks_diff(ticks_ms(), start)
+
+    print(f"{frames} frames in {elapsed}ms: {frames * 1000 / elapsed:.1f} fps  {panel.stats()}")
+    panel.fill(0,0,0,0)
+    panel.update()
+    panel.deinit()
+
+def fade_test(repeats=10):
+    # Check the compiled firelight fades against the Python reference, then time them and the whole effect at three sizes
+    from time   import ticks_us, ticks_diff
+    from random import getrandbits
+    import array
+    import led_panel as lp
+
+    for fade in (0, 1, 128, 255):
+        data      = [getrandbits(24) for _ in range(1024)]
+        reference = array.array("I", data)
+        compiled  = array.array("I", data)
+        table     = array.array("I", data)
+        lp.fade_reference(reference, len(reference), fade)
+        lp._fade(compiled, len(compiled), fade)
+        lp._fade_lut(table, len(table), lp.fade_table(fade))
+        print(f"Fade {fade:3}: {'OK' if reference == compiled == table else 'FAILED'}")
+
+    for width in (8, 32, 128):                     # 256, 1024 and 4096 LEDs
+        panel = led_panel(pin=27, width=width, height=32)
+        strip = panel._strip
+
+        start = ticks_us()
+        for _ in range(repeats):
+            lp.fade_reference(strip, len(strip), 255)
+        python = ticks_diff(ticks_us(), start) // repeats
+
+        start = ticks_us()
+        for _ in range(repeats):
+            lp._fade(strip, len(strip), 255)
+        viper = ticks_diff(ticks_us(), start) // repeats
+
+        lut   = lp.fade_table(255)
+        start = ticks_us()
+        for _ in range(repeats):
+            lp._fade_lut(strip, len(strip), lut)
+        lookup = ticks_diff(ticks_us(), start) // repeats
+
+        start = ticks_us()
+        for _ in range(repeats):
+            panel.firelight(brightness=255, red=255, green=64, blue=10, speed=128, fade=255)
+        render = ticks_diff(ticks_us(), start) // repeats
+
+        panel.deinit()
+        print(f"{len(strip):4} LEDs: fade python {python}us  viper {viper}us  table {lookup}us  firelight {1_000_000 / render:.1f} fps")
+
+def heatfire_test(frames=100):
+    # Frames per second of the heat fire on a 32x32 panel, rendering only and then with the output
+    from time import ticks_ms, ticks_diff
+
+    panel = led_panel(pin=27, width=32, height=32)
+    start = ticks_ms()
+    for _ in range(frames):
+        panel.heatfire(brightness=255, red=255, green=255, blue=255, sparking=120, cooling=55)
+    render = ticks_diff(ticks_ms(), start)
+
+    start = ticks_ms()
+    for _ in range(frames):
+        panel.heatfire(brightness=255, red=255, green=255, blue=255, sparking=120, cooling=55)
+        panel.update()
+    shown = ticks_diff(ticks_ms(), start)
+
+    panel.fill(0,0,0,0)
+    panel.update()
+    panel.deinit()
+    print(f"Heat fire: rendering {frames * 1000 / render:.1f} fps, with output {frames * 1000 / shown:.1f} fps")
+
+def _firelight_per_led(strip, brightness, red, green, blue, speed, fade):
+    # The firelight as it was before it kept one colour per block - fading and brightening every LED
+    from prng import randint
+    import led_panel as lp
+
+    blocks = len(strip) // lp.FIRE_BLOCK
+    lp.fade_reference(strip, len(strip), fade)
+    if randint(0, 255) <= speed:
+        for _ in range(blocks * 3 // 4):
+            start = randint(0, blocks - 1) * lp.FIRE_BLOCK
+            R = randint(red//8,               red)
+            G = randint(min(R//16, green//4), min(R//8, green))
+            B = randint(min(G//16, blue//4),  min(G//8, blue))
+            R = (R * brightness) // 255
+            G = (G * brightness) // 255
+            B = (B * brightness) // 255
+            for led in range(start, start + lp.FIRE_BLOCK):
+                strip[led] = (G & 0xff) + ((R & 0xff) << 8) + ((B & 0xff) << 16)
+
+def firelight_block_test(frames=50):
+    # Check the block based firelight renders exactly the same frames as the per-LED version, starting from a beacon
+    import array
+    import prng
+
+    panel = led_panel(pin=27, width=32, height=32)
+    panel.beacon(255, 255, 128, 64, 0, 128)
+    reference = array.array("I", panel._strip)
+
+    matched = 0
+    for frame in range(frames):
+        fade = 255 - frame
+        prng.seed(frame)
+        panel.firelight(brightness=200, red=255, green=64, blue=10, speed=128, fade=fade)
+        prng.seed(frame)
+        _firelight_per_led(reference, 200, 255, 64, 10, 128, fade)
+        matched += panel._strip == reference
+
+    panel.deinit()
+    print(f"{matched} of {frames} frames identical: {'OK' if matched == frames else 'FAILED'}")
+
+def prng_test(draws=10000):
+    # Check the effects' random number generator repeats when seeded and covers its range, and time it against randint
+    from time   import ticks_us, ticks_diff
+    import random
+    import prng
+
+    prng.seed(1)
+    first = [prng.randint(0, 255) for _ in range(16)]
+    prng.seed(1)
+    again = [prng.randint(0, 255) for _ in range(16)]
+    print(f"Seeded sequence repeats: {'OK' if first == again else 'FAILED'}")
+
+    counts = [0] * 8
+    for _ in range(draws):
+        counts[prng.randint(0, 7)] += 1
+    print(f"randint(0, 7) counts {counts}: {'OK' if min(counts) > draws // 10 else 'FAILED'}")
+
+    start = ticks_us()
+    for _ in range(draws):
+        random.randint(0, 255)
+    library = ticks_diff(ticks_us(), start)
+
+    start = ticks_us()
+    for _ in range(draws):
+        prng.randint(0, 255)
+    fast = ticks_diff(ticks_us(), start)
+
+    buffer = bytearray(4096)
+    start  = ticks_us()
+    prng.fill(buffer)
+    fill   = ticks_diff(ticks_us(), start)
+    print(f"random.randint {library * 1000 // draws}ns  prng.randint {fast * 1000 // draws}ns  fill 4KB {fill}us")
+
+def group_test(pins=(27, 26), frames=50):
+    # Frame rate of the firelight across a group of 32x32 panels, against a single panel - it should be about the same
+    from time import ticks_ms, ticks_diff
+
+    for panels in (led_panel(pin=pins[0], width=32, height=32), panel_group(pins=pins, width=32, height=32)):
+        start = ticks_ms()
+        for _ in range(frames):
+            panels.firelight(brightness=255, red=255, green=64, blue=10, speed=128, fade=255)
+            panels.update()
+        elapsed = ticks_diff(ticks_ms(), start)
+
+        panels.fill(0,0,0,0)
+        panels.update()
+        panels.deinit()
+        print(f"{len(panels._outs)} panels: {frames * 1000 / elapsed:.1f} fps  {panels.stats()}")
+
+def geometry_test(repeats=5):
+    # Time drawing a gradient over a serpentine panel: working out each LED's position, looking it up in the geometry's
+    # table, drawing a row at a time from its row iterator, and through set_pixel()
+    from time     import ticks_us, ticks_diff
+    from geometry import panel_geometry
+
+    geometry = panel_geometry(32, 32, serpentine=True)
+    panel    = led_panel(pin=27, width=32, height=32, geometry=geometry)
+    strip    = panel._strip
+    width    = geometry.width
+    height   = geometry.height
+
+    start = ticks_us()
+    for _ in range(repeats):
+        for y in range(height):
+            for x in range(width):
+                led = x * height + (y if x % 2 == 0 else height - 1 - y)
+                strip[led] = (x * 8) << 8 | (y * 8)
+    calculated = ticks_diff(ticks_us(), start) // repeats
+
+    start = ticks_us()
+    for _ in range(repeats):
+        table = geometry.table
+        for y in range(height):
+            for x in range(width):
+                strip[table[y * width + x]] = (x * 8) << 8 | (y * 8)
+    looked_up = ticks_diff(ticks_us(), start) // repeats
+
+    start = ticks_us()
+    for _ in range(repeats):
+        for y in range(height):
+            x = 0
+            for led in geometry.row(y):
+                strip[led] = (x * 8) << 8 | (y * 8)
+                x += 1
+    rows = ticks_diff(ticks_us(), start) // repeats
+
+    start = ticks_us()
+    for _ in range(repeats):
+        for y in range(height):
+            for x in range(width):
+                panel.set_pixel(x, y, (x * 8) << 8 | (y * 8))
+    pixels = ticks_diff(ticks_us(), start) // repeats
+
+    panel.update()
+    panel.deinit()
+    print(f"Full panel draw: calculated {calculated}us  table {looked_up}us  rows {rows}us  set_pixel {pixels}us")
+
+def scroll_test(text="DMXfire", frames=100):
+    # Scroll text across the panel, drawn with framebuf on the panel's canvas, and drawn a pixel at a time from Python
+    # (using framebuf only to look up the font) - rendering time only
+    from time      import ticks_us, ticks_diff
+    from led_panel import rgb565
+    import framebuf
+
+    panel  = led_panel(pin=27, width=32, height=32)
+    canvas = panel.canvas()
+    width  = panel.geometry.width
+    colour = rgb565(255, 64, 0)
+
+    start = ticks_us()
+    for frame in range(frames):
+        canvas.fill(0)
+        canvas.text(text, width - frame % (width + 8 * len(text)), 12, colour)
+        panel.show_canvas()
+    framebuffer = ticks_diff(ticks_us(), start) // frames
+
+    # The text once in a one bit buffer, copied across a pixel at a time
+    text_width = 8 * len(text)
+    glyphs     = framebuf.FrameBuffer(bytearray(text_width), text_width, 8, framebuf.MONO_VLSB)
+    glyphs.text(text, 0, 0, 1)
+    led        = (255 << 8) | 64                   # The same colour as an LED, 0x00BBRRGG
+    height     = panel.geometry.height
+    start = ticks_us()
+    for frame in range(frames):
+        left = width - frame % (width + text_width)
+        for y in range(height):
+            top = height - 1 - y - 12                  # Row within the text, counting down from its top
+            for x in range(width):
+                lit = 0 <= x - left < text_width and 0 <= top < 8 and glyphs.pixel(x - left, top)
+                panel.set_pixel(x, y, led if lit else 0)
+    python = ticks_diff(ticks_us(), start) // frames
+
+    panel.update()
+    panel.deinit()
+    print(f"Scrolling text: framebuf {framebuffer}us/frame  per pixel {python}us/frame")
+
+def output_table_test(repeats=20):
+    # Time update() with the output at full brightness (a DMA copy), dimmed, and dimmed with gamma correction
+    from time import ticks_us, ticks_diff
+
+    panel = led_panel(pin=27, width=32, height=32, frames=3)
+    panel.firelight(brightness=255, red=255, green=64, blue=10, speed=255, fade=255)
+    for brightness, gamma in ((255, None), (128, None), (128, 2.2)):
+        start = ticks_us()
+        panel.set_output(brightness, gamma)
+        table = ticks_diff(ticks_us(), start)
+
+        start = ticks_us()
+        for _ in range(repeats):
+            panel.update()
+        update = ticks_diff(ticks_us(), start) // repeats
+        print(f"Brightness {brightness} gamma {gamma}: table {table}us, update {update}us")
+
+    panel.set_output()
+    panel.fill(0,0,0,0)
+    panel.update()
+    panel.deinit()
+
+def crossfade_test(frames=50):
+    # Time the crossfade blend for a 32x32 panel, and whole frames crossfading from the firelight to the beacon,
+    # against the time it takes to send a frame to the LEDs
+    from time import ticks_us, ticks_diff
+    from uctypes import addressof
+    from led_panel import _blend, scale_colour, LATCH_US, BIT_US
+    import array
+
+    panel  = led_panel(pin=27, width=32, height=32, frames=3)
+    leds   = 32 * 32
+    budget = int(leds * 24 * BIT_US) + LATCH_US
+
+    outgoing = array.array("I", [0x00102030 for _ in range(leds)])
+    incoming = array.array("I", [0x00302010 for _ in range(leds)])
+    dest     = array.array("I", [0 for _ in range(leds)])
+    strips   = array.array("I", [addressof(outgoing), addressof(incoming)])
+    start = ticks_us()
+    for mix in range(frames):
+        _blend(strips, dest, leds, mix * 256 // frames)
+    blend = ticks_diff(ticks_us(), start) // frames
+
+    colour = scale_colour(255, 0, 0, 255)
+    panel.start_crossfade()
+    start = ticks_us()
+    for mix in range(frames):
+        panel.swap_strips()
+        panel.firelight(brightness=255, red=255, green=64, blue=10, speed=128, fade=255)
+        panel.swap_strips()
+        panel.beacon_colour(colour, 128, 64)
+        panel.set_crossfade(mix * 256 // frames)
+        panel.update()
+    frame = ticks_diff(ticks_us(), start) // frames
+    panel.set_crossfade(256)
+
+    print(f"Blend {blend}us, crossfading frame {frame}us, frame budget {budget}us for {leds} LEDs: "
+          f"{'fits' if frame <= budget else 'too slow'}  {panel.stats()}")
+    panel.fill(0,0,0,0)
+    panel.update()
+    panel.deinit()
+
+def memory_test(width=32, height=32):
+    # Memory used by a panel with each combination of word or packed output frames and a strip or palette indices
+    for indexed in (False, True):
+        for packed in (False, True):
+            gc.collect()
+            before = gc.mem_free()
+            panel  = led_panel(pin=27, width=width, height=height, indexed=indexed, packed=packed)
+            gc.collect()
+            used   = before - gc.mem_free()
+            panel.deinit()
+            del panel
+            print(f"{'indexed' if indexed else 'strip  '} {'packed' if packed else 'words '}: {used} bytes")
+
+def parallel_test(lanes=8, leds=256, frames=50):
+    # Check the parallel driver's transpose against a plain Python one, then time it and the frame rate
+    from time   import ticks_us, ticks_diff
+    from random import getrandbits
+    from led_parallel import led_parallel, _transpose
+
+    strips = led_parallel(pin=8, lanes=lanes, leds=leds)
+    for strip in strips.strips:
+        for n in range(len(strip)):
+            strip[n] = getrandbits(8)
+
+    frame = strips._frames[0]
+    _transpose(strips._lanes, frame, 3 * leds)
+    expected = bytearray(8)
+    errors   = 0
+    for n in range(3 * leds):
+        for bit in range(8):
+            expected[bit] = 0
+            for lane in range(lanes):
+                expected[bit] |= ((strips.strips[lane][n] >> (7 - bit)) & 1) << lane
+        errors += frame[8 * n : 8 * n + 8] != expected
+    print(f"Transpose: {'OK' if errors == 0 else f'{errors} bytes FAILED'}")
+
+    start = ticks_us()
+    _transpose(strips._lanes, frame, 3 * leds)
+    transpose = ticks_diff(ticks_us(), start)
+
+    start = ticks_us()
+    for _ in range(frames):
+        strips.update()
+    elapsed = ticks_diff(ticks_us(), start)
+
+    for strip in strips.strips:
+        for n in range(len(strip)):
+            strip[n] = 0
+    strips.update()
+    strips.deinit()
+    print(f"{lanes} x {leds} LEDs: transpose {transpose}us, {frames * 1_000_000 / elapsed:.1f} fps")
+
 def pin_test():
     from machine import Pin
 
@@ -51,6 +605,7 @@ def fire_test():
 
     firelight.fill(0,0,0,0)
     firelight.update()
+    firelight.deinit()
     print("Finished")
 
 def firelight():